@@ -18,21 +18,49 @@ it will default run for 1 hour. Else, the "-" will be split upon by the code to
    "destination_path": "C:\\Users\\iqbal\\New Folder"
 }
    ```
+4. Every file is downloaded by a pipeline: the main thread reads the file from the server with up to
+    ```--max_requests <n>``` (default 64) SFTP read requests in flight, in blocks of ```--block_size <KB>```
+    (default 1024), into a queue of at most ```--queue_blocks <n>``` (default 16) blocks, and a writer thread writes
+    them to disk. A slow disk and a slow network do not wait on each other, until the queue is full. The file is
+    preallocated, written to ```<file>.part``` and renamed when complete. ```--fsync_every <MB>``` flushes the
+    written data to the disk every that many MB and before the rename (by default the OS decides when).
+    The same keys can be given in the JSON file.
+5. ```--listing exec``` lists the whole remote tree with a single ```find``` command over the SSH exec channel,
+    instead of one SFTP round trip per folder (```--listing sftp```, the default). The listing is compared to the
+    local files as it streams in. If the server cannot run the command, it falls back to the SFTP walk. The time of
+    every poll is logged, with the listing used, and summed up per listing at the end.
+6. The SFTP session and the listing command run on channels of a single SSH connection, shared through
+    ```common/transport.py```. ```--ssh_config <file.json>``` sets the known hosts file (```~/.ssh/known_hosts``` by
+    default), whether unknown host keys are refused (```"strict_host_keys": true```) or trusted for the run, and
+    the credentials of the server, instead of ```-u``` and ```-p```. A host key that changed is always refused.
 
 """
 
 import sys
 import os
-import logging
-import tempfile
 import datetime
 import argparse
+import contextlib
 import json
+import posixpath
+import shlex
 import time
-import pysftp
+import queue
+import threading
 import stat
 
+# The modules shared by all the tools live in the "common" package at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logger import init_logger as init_shared_logger, get_item_logger, shutdown_logging  # noqa: E402
+from common.transport import load_config as load_ssh_config, open_sftp, set_credentials  # noqa: E402
+
 log = None
+log_items = None  # For the messages logged once per file, see init_logger
+
+# Defaults of the download pipeline, see start_download_pipeline
+BLOCK_SIZE_KB = 1024
+MAX_REQUESTS = 64
+QUEUE_BLOCKS = 16
 
 
 def init_logger():
@@ -42,26 +70,10 @@ def init_logger():
     -------
     Logger object
     """
-    tempdir = tempfile.mkdtemp(
-        prefix=f'downloader_framework_{os.getpid()}__{datetime.datetime.now().strftime("%H_%M_%S")}')
-
-    logger = logging.getLogger('downloader_framework')
-    logger.setLevel(logging.DEBUG)
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler(os.path.join(tempdir, 'logfile.log'))
-    fh.setLevel(logging.DEBUG)
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(filename)s:%(lineno)s - %(funcName)20s() - %(levelname)s - %(message)s')
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
-    # add the handlers to logger
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-
+    global log_items
+    logger = init_shared_logger('downloader_framework')
+    # Checking every file is logged at DEBUG (hence dropped by default), and downloads at most 50 times a second
+    log_items = get_item_logger(logger, max_per_second=50)
     return logger
 
 
@@ -87,6 +99,20 @@ def parse_args():
                         default=None, type=str)
     parser.add_argument("-j", "--json_config", help="JSON file containing the configuration",
                         default=None, type=str)
+    parser.add_argument("--block_size", help="Size in KB of the blocks read from the server and written to disk",
+                        default=None, type=int)
+    parser.add_argument("--max_requests", help="Maximum number of SFTP read requests in flight for a file",
+                        default=None, type=int)
+    parser.add_argument("--queue_blocks", help="Maximum number of blocks read but not written yet",
+                        default=None, type=int)
+    parser.add_argument("--listing", help="How the remote tree is listed: one SFTP round trip per folder (sftp), "
+                                          "or a single find command over the SSH exec channel (exec)",
+                        default=None, choices=['sftp', 'exec'])
+    parser.add_argument("--ssh_config", help="JSON file with the known hosts and the credentials of the server",
+                        default=None, type=str)
+    parser.add_argument("--fsync_every", help="Flush the written data to disk every that many MB, and at the end "
+                                              "of every file",
+                        default=None, type=float)
 
     return vars(parser.parse_args())
 
@@ -108,10 +134,14 @@ def validate_parameters(args):
     log.info("Validating parameters")
     if args.get('ip_address') is None:
         raise ValueError("IP Address is needed for remoting to the machine")
-    if args.get('username') is None:
-        raise ValueError('No username given to the script. Username required for SSH/SFTP')
-    if args.get('password') is None:
-        raise ValueError('No password given to the script. Password required for SSH/SFTP')
+    if args.get('ssh_config') is not None:
+        if not os.path.isfile(args.get('ssh_config')):
+            raise FileNotFoundError(f'SSH config file {args.get("ssh_config")} not found')
+    else:
+        if args.get('username') is None:
+            raise ValueError('No username given to the script. Username required for SSH/SFTP')
+        if args.get('password') is None:
+            raise ValueError('No password given to the script. Password required for SSH/SFTP')
     if args.get('source_path') is None:
         raise ValueError('Source path must be given to copy the files from')
     if args.get('destination_path') is None:
@@ -121,6 +151,11 @@ def validate_parameters(args):
             f'The folder, {args.get("destination_path")} does not exist on local machine. Please create the folder')
     if args.get('time_window') is None:
         raise ValueError('Time window must be given to the script')
+    if args.get('listing') not in [None, 'sftp', 'exec']:
+        raise ValueError('listing must be either sftp or exec')
+    for option in ['block_size', 'max_requests', 'queue_blocks', 'fsync_every']:
+        if args.get(option) is not None and args.get(option) <= 0:
+            raise ValueError(f'{option} must be positive')
 
 
 def sanitise_args(args):
@@ -150,6 +185,440 @@ def sanitise_args(args):
             "time_window must be of size 2, that is, it should contain 1 start element and one end element")
 
 
+def start_download_pipeline(block_size=None, max_requests=None, queue_blocks=None, fsync_every=None):
+    """
+    Start the writer thread of the download pipeline. The files are read from the server on the calling thread
+    (see ``download_file``) and handed over as blocks through a bounded queue to the writer thread.
+    Parameters
+    ----------
+    block_size: int
+        Size in KB of the blocks read from the server and written to disk
+    max_requests: int
+        Maximum number of SFTP read requests in flight for a file
+    queue_blocks: int
+        Maximum number of blocks read but not written yet. The reader waits for the writer when the queue is full
+    fsync_every: float
+        Flush the written data to disk every that many MB, and before renaming a complete file. Never if None
+
+    Returns
+    -------
+    dict
+        The pipeline: its settings, ``queue``, writer ``thread`` and the ``error`` of the writer (None if none)
+    """
+    pipeline = {
+        'block_size': (block_size or BLOCK_SIZE_KB) * 1024,
+        'max_requests': max_requests or MAX_REQUESTS,
+        'fsync_every': None if fsync_every is None else int(fsync_every * 1024 * 1024),
+        'queue': queue.Queue(maxsize=queue_blocks or QUEUE_BLOCKS),
+        'error': None,
+    }
+    pipeline['thread'] = threading.Thread(target=write_blocks, args=(pipeline,), name='download_writer', daemon=True)
+    pipeline['thread'].start()
+    return pipeline
+
+
+def open_local_file(local_path, size):
+    """
+    Open the temporary file a download is written to, preallocated to the size of the remote file so that the
+    disk space is reserved at once and the file is not grown block by block
+    Parameters
+    ----------
+    local_path: str
+        Path of the downloaded file. The data is written to ``<local_path>.part``
+    size: int
+        Size of the remote file
+
+    Returns
+    -------
+    file object
+        The temporary file, opened for writing
+    """
+    local_file = open(local_path + '.part', 'wb')
+    try:
+        if size:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(local_file.fileno(), 0, size)
+            else:
+                local_file.truncate(size)
+    except OSError:
+        # e.g. not enough space on the disk for the file
+        local_file.close()
+        os.remove(local_path + '.part')
+        raise
+    return local_file
+
+
+def write_blocks(pipeline):
+    """
+    The writer thread. Writes the blocks of the queue to the files, one file after the other. The messages are
+    ``('open', local_path, size)``, ``('data', block)``, ``('close',)``, ``('abort',)`` and None to stop. After an
+    error, the error is kept in the pipeline and the messages are dropped until the next file.
+    Parameters
+    ----------
+    pipeline: dict
+        The pipeline, see ``start_download_pipeline``
+
+    Returns
+    -------
+    None
+    """
+    local_file = local_path = None
+    written = unsynced = 0
+    while True:
+        message = pipeline['queue'].get()
+        try:
+            if message is None:
+                break
+            if message[0] == 'open':
+                _, local_path, size = message
+                local_file = open_local_file(local_path, size)
+                written = unsynced = 0
+            elif local_file is None:
+                # The file failed, drop the rest of it
+                continue
+            elif message[0] == 'data':
+                local_file.write(message[1])
+                written += len(message[1])
+                unsynced += len(message[1])
+                if pipeline['fsync_every'] is not None and unsynced >= pipeline['fsync_every']:
+                    local_file.flush()
+                    os.fsync(local_file.fileno())
+                    unsynced = 0
+            elif message[0] == 'close':
+                # The remote file may have shrunk since it was preallocated
+                local_file.truncate(written)
+                if pipeline['fsync_every'] is not None:
+                    local_file.flush()
+                    os.fsync(local_file.fileno())
+                local_file.close()
+                local_file = None
+                os.replace(local_path + '.part', local_path)
+            elif message[0] == 'abort':
+                local_file.close()
+                local_file = None
+                os.remove(local_path + '.part')
+        except Exception as error:
+            pipeline['error'] = error
+            if local_file is not None:
+                local_file.close()
+                local_file = None
+                os.remove(local_path + '.part')
+        finally:
+            pipeline['queue'].task_done()
+
+
+def put_block(pipeline, message):
+    """
+    Hand a message over to the writer thread, waiting while the queue is full
+    Parameters
+    ----------
+    pipeline: dict
+        The pipeline, see ``start_download_pipeline``
+    message: tuple
+        The message, see ``write_blocks``
+
+    Returns
+    -------
+    None
+    """
+    while True:
+        # Do not wait on a writer that failed
+        if pipeline['error'] is not None:
+            error, pipeline['error'] = pipeline['error'], None
+            raise error
+        try:
+            pipeline['queue'].put(message, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+
+def download_file(sftp, remote_path, local_path, size, pipeline):
+    """
+    Read a file from the server with many read requests in flight, and hand it over block by block to the writer
+    thread, which writes it to disk at the same time
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    remote_path: str
+        Path of the file on the server
+    local_path: str
+        Path of the downloaded file
+    size: int
+        Size of the file on the server
+    pipeline: dict
+        The pipeline, see ``start_download_pipeline``
+
+    Returns
+    -------
+    None
+    """
+    put_block(pipeline, ('open', local_path, size))
+    try:
+        with sftp.open(remote_path, 'rb') as remote_file:
+            remote_file.prefetch(size, max_concurrent_requests=pipeline['max_requests'])
+            while True:
+                block = remote_file.read(pipeline['block_size'])
+                if not block:
+                    break
+                put_block(pipeline, ('data', block))
+    except Exception:
+        pipeline['queue'].put(('abort',))
+        raise
+    put_block(pipeline, ('close',))
+
+
+def wait_for_writes(pipeline):
+    """
+    Wait until the writer thread has written every file handed over to it
+    Parameters
+    ----------
+    pipeline: dict
+        The pipeline, see ``start_download_pipeline``
+
+    Returns
+    -------
+    None
+    """
+    pipeline['queue'].join()
+    if pipeline['error'] is not None:
+        error, pipeline['error'] = pipeline['error'], None
+        raise error
+
+
+def stop_download_pipeline(pipeline):
+    """
+    Stop the writer thread, once it has written everything handed over to it
+    Parameters
+    ----------
+    pipeline: dict
+        The pipeline, see ``start_download_pipeline``
+
+    Returns
+    -------
+    None
+    """
+    pipeline['queue'].put(None)
+    pipeline['thread'].join()
+
+
+def fetch_file(sftp, remote_path, local_path, size, pipeline=None):
+    """
+    Download a file, through the download pipeline if given
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    remote_path: str
+        Path of the file on the server
+    local_path: str
+        Path of the downloaded file
+    size: int
+        Size of the file on the server
+    pipeline: dict
+        The download pipeline, see ``start_download_pipeline``. The file is downloaded with ``sftp.get`` if None
+
+    Returns
+    -------
+    None
+    """
+    if pipeline is None:
+        sftp.get(remote_path, local_path)
+    else:
+        download_file(sftp, remote_path, local_path, size, pipeline)
+
+
+def open_exec_channel(sftp, command):
+    """
+    Run a command on the server, over a new channel of the (shared) SSH transport the SFTP session runs on
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    command: str
+        The command to run
+
+    Returns
+    -------
+    paramiko.Channel
+        The channel, with the output of the command to be read from
+    """
+    channel = sftp.sftp_client.get_channel().get_transport().open_session()
+    channel.exec_command(command)
+    return channel
+
+
+def read_remote_listing(channel, chunk_size=65536):
+    """
+    Parse the listing written by ``find -L -printf '%y %s %T@ %P\\0'`` as it streams in. Every entry ends with a NUL
+    byte, so any file name can be listed.
+    Parameters
+    ----------
+    channel: paramiko.Channel
+        The channel running the command
+    chunk_size: int
+        Number of bytes received at once
+
+    Returns
+    -------
+    generator
+        (type, size, mtime, path relative to the listed folder) tuples, the type being ``f`` for a file, ``d`` for a
+        folder and ``l`` for a broken symbolic link (the other links are listed as what they point to)
+    """
+    pending = b''
+    while True:
+        data = channel.recv(chunk_size)
+        if not data:
+            break
+        entries = (pending + data).split(b'\0')
+        pending = entries.pop()
+        for entry in entries:
+            kind, size, mtime, path = entry.split(b' ', 3)
+            yield kind.decode(), int(size), float(mtime), path.decode('utf-8', 'surrogateescape')
+
+
+def fetch_with_remote_listing(sftp, source_path, destination_path, pipeline=None):
+    """
+    Fetch the new and modified files, listing the whole remote tree with a single ``find`` command instead of one
+    SFTP round trip per folder. The entries are compared to the local files, and downloaded, as they stream in.
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    source_path: str
+        The source path where the files are stored
+    destination_path: str
+        The destination path where the files are stored
+    pipeline: dict
+        The download pipeline, see ``start_download_pipeline``
+
+    Returns
+    -------
+    int
+        The number of entries listed, or None if the server could not list the tree (no exec channel, no ``find``
+        or a ``find`` without ``-printf``)
+    """
+    # Symbolic links are followed (-L), so they are listed, and downloaded, as the file or folder they point to
+    command = f"find -L {shlex.quote(source_path)} -mindepth 1 -printf '%y %s %T@ %P\\0' 2>/dev/null"
+    try:
+        channel = open_exec_channel(sftp, command)
+    except Exception as error:
+        log.warning(f'Could not run the remote listing: {error}')
+        return None
+
+    entries = 0
+    try:
+        for kind, size, mtime, path in read_remote_listing(channel):
+            entries += 1
+            local_path = os.path.join(destination_path, *path.split('/'))
+            if kind == 'd':
+                os.makedirs(local_path, exist_ok=True)
+            elif kind == 'f':
+                log_items.debug('Checking %s', path)
+                if (not os.path.isfile(local_path)) or (mtime > os.path.getmtime(local_path)):
+                    log_items.info('File %s is different or modified. Downloading %s', path, path)
+                    fetch_file(sftp, posixpath.join(source_path, path), local_path, size, pipeline)
+        status = channel.recv_exit_status()
+    finally:
+        channel.close()
+
+    if status != 0:
+        if not entries:
+            log.warning(f'The remote listing failed with exit status {status}')
+            return None
+        # e.g. a folder that cannot be read, the rest of the tree is listed
+        log.warning(f'The remote listing exited with status {status}, some files may not be listed')
+    return entries
+
+
+def init_listing_state(listing=None):
+    """
+    Initialise the listing state kept between the polls
+    Parameters
+    ----------
+    listing: str
+        The listing asked for, ``sftp`` (default) or ``exec``
+
+    Returns
+    -------
+    dict
+        The ``listing`` used and the ``cycle_times`` of every listing
+    """
+    return {'listing': listing or 'sftp', 'cycle_times': {'sftp': [], 'exec': []}}
+
+
+def fetch_changes(sftp, source_path, destination_path, pipeline, listing_state):
+    """
+    Fetch the new and modified files with the listing of the state. If the remote listing does not work on the
+    server, the SFTP walk is used instead, for this poll and the next ones.
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    source_path: str
+        The source path where the files are stored
+    destination_path: str
+        The destination path where the files are stored
+    pipeline: dict
+        The download pipeline, see ``start_download_pipeline``
+    listing_state: dict
+        The listing state, see ``init_listing_state``
+
+    Returns
+    -------
+    str
+        The listing used
+    """
+    if listing_state['listing'] == 'exec':
+        if fetch_with_remote_listing(sftp, source_path, destination_path, pipeline) is not None:
+            return 'exec'
+        log.warning('Falling back to the SFTP walk')
+        listing_state['listing'] = 'sftp'
+    start_fetch_from_remote_server_core(sftp, source_path, destination_path, pipeline)
+    return 'sftp'
+
+
+def record_cycle_time(listing_state, listing, cycle_time):
+    """
+    Record and log the time a poll took
+    Parameters
+    ----------
+    listing_state: dict
+        The listing state, see ``init_listing_state``
+    listing: str
+        The listing used by the poll
+    cycle_time: float
+        Seconds the poll took
+
+    Returns
+    -------
+    None
+    """
+    listing_state['cycle_times'][listing].append(cycle_time)
+    log.info(f'Poll took {cycle_time:.3f}s with the {listing} listing')
+
+
+def report_cycle_times(listing_state):
+    """
+    Log the number of polls, and their mean and max time, for every listing used
+    Parameters
+    ----------
+    listing_state: dict
+        The listing state, see ``init_listing_state``
+
+    Returns
+    -------
+    dict
+        The ``polls``, ``mean`` and ``max`` seconds of every listing used
+    """
+    report = {listing: {'polls': len(times), 'mean': sum(times) / len(times), 'max': max(times)}
+              for listing, times in listing_state['cycle_times'].items() if times}
+    for listing, times in report.items():
+        log.info(f'{listing} listing: {times["polls"]} polls, {times["mean"]:.3f}s mean, {times["max"]:.3f}s max')
+    return report
+
+
 def start_fetch_from_remote_server(args):
     """
 
@@ -163,22 +632,32 @@ def start_fetch_from_remote_server(args):
     None
     """
     log.info('Running start_fetch_from_remote_server')
-    cnopts = pysftp.CnOpts()
-    cnopts.hostkeys = None
-    with pysftp.Connection(args['ip_address'], username=args['username'], password=args['password'],
-                           cnopts=cnopts) as sftp:
+    if args.get('ssh_config') is not None:
+        load_ssh_config(args['ssh_config'])
+    # The username and the password given to the script win over the ones in the SSH config
+    set_credentials(args['ip_address'], username=args.get('username'), password=args.get('password'))
+    pipeline = start_download_pipeline(args.get('block_size'), args.get('max_requests'), args.get('queue_blocks'),
+                                       args.get('fsync_every'))
+    with open_sftp(args['ip_address']) as sftp, contextlib.ExitStack() as stack:
+        stack.callback(stop_download_pipeline, pipeline)
         # Check if remote path exists on the server or not
         if not sftp.exists(args['source_path']):
             raise FileNotFoundError(f'Source path {args["source_path"]} does not exist. Please enter valid source path')
 
         # Here, I have deliberately kept the while inside to avoid creation and deletion of the sftp object
         # Loads of sftp connections over time will overwhelm the server!
+        listing_state = init_listing_state(args.get('listing'))
         while True:
-            start_fetch_from_remote_server_core(sftp, args['source_path'], args['destination_path'])
+            cycle_start = time.perf_counter()
+            listing = fetch_changes(sftp, args['source_path'], args['destination_path'], pipeline, listing_state)
+            # Every file fetched is on disk before the next poll compares the files again
+            wait_for_writes(pipeline)
+            record_cycle_time(listing_state, listing, time.perf_counter() - cycle_start)
 
             if (args['time_window'][1] - datetime.datetime.now()).days == -1:
                 # If we have crossed the window, break the while loop
                 log.info('Breaking out of loop, since time window has elapsed.')
+                report_cycle_times(listing_state)
                 break
             else:
                 # A healthy poll of 10 seconds
@@ -186,37 +665,39 @@ def start_fetch_from_remote_server(args):
                 time.sleep(10)
 
 
-def start_fetch_from_remote_server_core(sftp, source_path, destination_path):
+def start_fetch_from_remote_server_core(sftp, source_path, destination_path, pipeline=None):
     """
     Core function that has the business logic for fetching everything from the server
     Parameters
     ----------
-    sftp: pysftp.Connection:
+    sftp: common.transport.SFTPSession:
         The SFTP connection object
     source_path: str
         The source path where the files are stored
     destination_path: str
         The destination path where the files are stored
+    pipeline: dict
+        The download pipeline, see ``start_download_pipeline``. The files are downloaded with ``sftp.get`` if None
 
     Returns
     -------
     None
     """
-    sftp.cwd(source_path)
-    for f in sftp.listdir_attr():
+    # Full remote paths, so that the walk does not depend on (nor change) the current remote folder
+    for f in sftp.listdir_attr(source_path):
+        remote_path = posixpath.join(source_path, f.filename)
         if not stat.S_ISDIR(f.st_mode):
-            log.info(f'Checking {f.filename}')
+            log_items.debug('Checking %s', f.filename)
             local_file_path = os.path.join(destination_path, f.filename)
             if (not os.path.isfile(local_file_path)) or (f.st_mtime > os.path.getmtime(local_file_path)):
-                log.info(f'File {f.filename} is different or modified.')
-                log.info(f'Downloading {f.filename}')
-                sftp.get(f.filename, local_file_path)
+                log_items.info('File %s is different or modified. Downloading %s', f.filename, f.filename)
+                fetch_file(sftp, remote_path, local_file_path, f.st_size, pipeline)
         elif stat.S_ISDIR(f.st_mode):
             # check if local directory exists, if not, then make it
-            if not os.path.isdir(os.path.join(destination_path, f.filename)):
-                os.mkdir(os.path.join(destination_path, f.filename))
-            destination_path = os.path.join(destination_path, f.filename)
-            start_fetch_from_remote_server_core(sftp, f.filename, destination_path)
+            local_folder_path = os.path.join(destination_path, f.filename)
+            if not os.path.isdir(local_folder_path):
+                os.mkdir(local_folder_path)
+            start_fetch_from_remote_server_core(sftp, remote_path, local_folder_path, pipeline)
 
 
 def main():
@@ -276,7 +757,7 @@ def main():
         log.exception(error)
 
     finally:
-        logging.shutdown()
+        shutdown_logging()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,175 @@
+import unittest
+import io
+import os
+import posixpath
+import stat
+import tempfile
+from unittest import mock
+import main
+
+
+class FakeRemoteFile(io.BytesIO):
+    """
+    Stand-in for a ``paramiko.SFTPFile``, recording the prefetch and the size of every read
+    """
+
+    def __init__(self, data, fail_after=None):
+        super().__init__(data)
+        self.prefetched = None
+        self.reads = []
+        self.fail_after = fail_after
+
+    def prefetch(self, file_size=None, max_concurrent_requests=None):
+        self.prefetched = (file_size, max_concurrent_requests)
+
+    def read(self, size=-1):
+        if self.fail_after is not None and len(self.reads) == self.fail_after:
+            raise ConnectionError('connection dropped')
+        self.reads.append(size)
+        return super().read(size)
+
+
+class FakeSFTPConnection:
+    """
+    Stand-in for the subset of ``common.transport.SFTPSession`` used to fetch a folder. ``files`` maps the remote
+    paths of the files, relative to ``/remote``, to their content.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.opened = {}
+        self.listed = []
+
+    def listdir_attr(self, path='.'):
+        self.listed.append(path)
+        folder = posixpath.relpath(path, '/remote')
+        children = {}
+        for file_path, data in self.files.items():
+            parent, _, rest = posixpath.relpath(file_path, folder).partition('/')
+            if not posixpath.relpath(file_path, folder).startswith('..'):
+                children[parent] = len(data) if not rest else None
+        return [mock.Mock(filename=name, st_mode=stat.S_IFREG if size is not None else stat.S_IFDIR,
+                          st_size=size or 0, st_mtime=0) for name, size in children.items()]
+
+    def open(self, remote_path, mode='r'):
+        file_path = posixpath.relpath(remote_path, '/remote') if posixpath.isabs(remote_path) else remote_path
+        self.opened[file_path] = FakeRemoteFile(self.files[file_path])
+        return self.opened[file_path]
+
+
+class FakeChannel:
+    """
+    Stand-in for the ``paramiko.Channel`` running the remote listing
+    """
+
+    def __init__(self, output, exit_status=0, chunk_size=7):
+        self.output = io.BytesIO(output)
+        self.exit_status = exit_status
+        self.chunk_size = chunk_size
+
+    def recv(self, size):
+        # Small chunks, which split the entries anywhere
+        return self.output.read(min(size, self.chunk_size))
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def close(self):
+        pass
+
+
+class TestDownloaderFramework(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        main.log = main.init_logger()
+
+    def test_download_pipeline(self):
+        files = {'big.bin': os.urandom(300 * 1024), 'small.txt': b'hello\n', 'empty': b''}
+        sftp = FakeSFTPConnection(files)
+        with tempfile.TemporaryDirectory() as tempdir:
+            pipeline = main.start_download_pipeline(block_size=64, max_requests=8, queue_blocks=2, fsync_every=0.1)
+            try:
+                main.start_fetch_from_remote_server_core(sftp, '/remote', tempdir, pipeline)
+                main.wait_for_writes(pipeline)
+            finally:
+                main.stop_download_pipeline(pipeline)
+            self.assertEqual(sorted(os.listdir(tempdir)), sorted(files))
+            for filename, data in files.items():
+                with open(os.path.join(tempdir, filename), 'rb') as f:
+                    self.assertEqual(f.read(), data)
+            self.assertEqual(sftp.listed, ['/remote'])
+            self.assertEqual(sftp.opened['big.bin'].prefetched, (300 * 1024, 8))
+            self.assertEqual(set(sftp.opened['big.bin'].reads), {64 * 1024})
+
+    def test_download_pipeline_failure(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            local_path = os.path.join(tempdir, 'big.bin')
+            sftp = FakeSFTPConnection({'big.bin': b'x' * 1024})
+            sftp.open = lambda remote_path, mode='r': FakeRemoteFile(b'x' * 1024, fail_after=1)
+            pipeline = main.start_download_pipeline(block_size=1)
+            try:
+                with self.assertRaises(ConnectionError):
+                    main.download_file(sftp, 'big.bin', local_path, 1024, pipeline)
+                main.wait_for_writes(pipeline)
+            finally:
+                main.stop_download_pipeline(pipeline)
+            # Neither a partial file, nor its temporary file are left behind
+            self.assertEqual(os.listdir(tempdir), [])
+
+            # A failing disk is raised to the reader
+            pipeline = main.start_download_pipeline()
+            try:
+                with mock.patch.object(main, 'open_local_file', side_effect=OSError('disk full')):
+                    with self.assertRaises(OSError):
+                        main.download_file(FakeSFTPConnection({'big.bin': b'x'}), 'big.bin', local_path, 1,
+                                           pipeline)
+                        main.wait_for_writes(pipeline)
+            finally:
+                main.stop_download_pipeline(pipeline)
+
+    def test_remote_listing(self):
+        files = {'a.txt': b'a', 'sub/b c\tc.txt': b'bc', 'sub/deeper/d.txt': b'd'}
+        listing = b'f 1 1700000000.5 a.txt\0d 4096 1700000000.0 sub\0f 2 1700000000.25 sub/b c\tc.txt\0' \
+                  b'd 4096 1700000000.0 sub/deeper\0f 1 1700000000.0 sub/deeper/d.txt\0' \
+                  b'l 9 1700000000.0 broken_link\0'
+        self.assertEqual(list(main.read_remote_listing(FakeChannel(listing)))[2],
+                         ('f', 2, 1700000000.25, 'sub/b c\tc.txt'))
+
+        pipeline = main.start_download_pipeline()
+        self.addCleanup(main.stop_download_pipeline, pipeline)
+        with tempfile.TemporaryDirectory() as tempdir:
+            sftp = FakeSFTPConnection(files)
+            listing_state = main.init_listing_state('exec')
+            with mock.patch.object(main, 'open_exec_channel', return_value=FakeChannel(listing)) as exec_channel:
+                self.assertEqual(main.fetch_changes(sftp, '/remote', tempdir, pipeline, listing_state), 'exec')
+                main.wait_for_writes(pipeline)
+            self.assertIn("find -L /remote -mindepth 1 -printf '%y %s %T@ %P\\0'", exec_channel.call_args[0][1])
+            # A broken link is not downloaded, the links that resolve are listed as their target
+            self.assertNotIn('broken_link', os.listdir(tempdir))
+            # A single command, and no SFTP listing at all
+            self.assertEqual(sftp.listed, [])
+            with open(os.path.join(tempdir, 'sub', 'b c\tc.txt'), 'rb') as f:
+                self.assertEqual(f.read(), b'bc')
+
+            # A server that cannot run the listing falls back to the SFTP walk, for good
+            sftp = FakeSFTPConnection(files)
+            with tempfile.TemporaryDirectory() as fallback_dir:
+                with mock.patch.object(main, 'open_exec_channel', return_value=FakeChannel(b'', 127)):
+                    self.assertEqual(main.fetch_changes(sftp, '/remote', fallback_dir, pipeline, listing_state),
+                                     'sftp')
+                    main.wait_for_writes(pipeline)
+                self.assertEqual(listing_state['listing'], 'sftp')
+                self.assertEqual(sftp.listed, ['/remote', '/remote/sub', '/remote/sub/deeper'])
+                with open(os.path.join(fallback_dir, 'sub', 'deeper', 'd.txt'), 'rb') as f:
+                    self.assertEqual(f.read(), b'd')
+
+            main.record_cycle_time(listing_state, 'exec', 0.5)
+            main.record_cycle_time(listing_state, 'sftp', 2.0)
+            main.record_cycle_time(listing_state, 'sftp', 4.0)
+            self.assertEqual(main.report_cycle_times(listing_state), {'exec': {'polls': 1, 'mean': 0.5, 'max': 0.5},
+                                                                      'sftp': {'polls': 2, 'mean': 3.0, 'max': 4.0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,23 +14,37 @@ in memory in disk), but the tradeoff is that we spend compute cycles on it.
 space is super cheap, and can store large objects. Requires replication of the queue.
 3. MEMORY: This is a compromise between DISK and COMPUTE. Not that fast,
 but not that slow either. Again, requires replication of the queue.
+4. PARALLEL: Same output as COMPUTE, for logs with many prints. Since the queue is first in first out, every
+version is a slice of the sequence of all the enqueued elements, so the versions are materialized straight from
+that sequence, in a pool of worker processes sharing it (see process_queue_in_parallel).
 
 
 1. Run the file by executing (python 3 required since f-strings are used!)
     ```python.exe 02_version_queue/main.py <number_of_inputs>```
     assuming your working directory is "AlphaGrepTakeHomeTest".
 2. Then add the number of operations, followed by the operations on the screen.
+3. ```--mode <compute/disk/memory/parallel>``` chooses the mode (default compute). In parallel mode,
+    ```--workers <n>``` is the number of worker processes (default: number of CPUs).
 """
 import copy
 import sys
 import os
-import logging
+import argparse
+import bisect
+import itertools
 import tempfile
-import datetime
 import pickle
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from multiprocessing import shared_memory
+
+# The modules shared by all the tools live in the "common" package at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logger import init_logger as init_shared_logger, get_item_logger, shutdown_logging  # noqa: E402
 
 log = None
+log_items = None  # For the message logged once per print, see init_logger
 queue = []
 queue_state = {}  # For DISK and MEMORY states
 tempdir = tempfile.mkdtemp(prefix=f'version_queue_pickle_{os.getpid()}_')
@@ -40,6 +54,7 @@ class Mode(Enum):
     COMPUTE = 1
     DISK = 2
     MEMORY = 3
+    PARALLEL = 4
 
 
 def init_logger():
@@ -49,26 +64,9 @@ def init_logger():
     -------
     Logger object
     """
-    tempdir = tempfile.mkdtemp(
-        prefix=f'downloader_framework_{os.getpid()}__{datetime.datetime.now().strftime("%H_%M_%S")}')
-
-    logger = logging.getLogger('version_queue')
-    logger.setLevel(logging.DEBUG)
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler(os.path.join(tempdir, 'logfile.log'))
-    fh.setLevel(logging.DEBUG)
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(filename)s:%(lineno)s - %(funcName)20s() - %(levelname)s - %(message)s')
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
-    # add the handlers to logger
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-
+    global log_items
+    logger = init_shared_logger('version_queue')
+    log_items = get_item_logger(logger)
     return logger
 
 
@@ -83,6 +81,21 @@ def parse_args():
     return [input() for i in range(number_of_inputs)]
 
 
+def parse_options():
+    """
+    Parses the options given on the command line, the operations themselves are read from the standard input
+    Returns
+    -------
+    dictionary: A dictionary object containing the options passed
+    """
+    parser = argparse.ArgumentParser(description='Version queue.')
+    parser.add_argument("--mode", help="The mode to run the queue in", default='compute',
+                        choices=[mode.name.lower() for mode in Mode])
+    parser.add_argument("--workers", help="Number of processes materializing the versions in parallel mode",
+                        default=None, type=int)
+    return vars(parser.parse_args())
+
+
 def sanitise_args(args):
     """
     Sanitise the arguments given to the script.
@@ -125,7 +138,7 @@ def dequeue():
 
 def print_noncompute(state):
     global queue_state
-    log.info(f'The queue at version {state} is {queue_state[int(state)]}.')
+    log_items.info('The queue at version %s is %s.', state, queue_state[int(state)])
     print(queue_state[int(state)])
 
 
@@ -138,7 +151,7 @@ def print_compute(args, state):
             queue_copy.pop()
         if element[0] == 'd':
             queue_copy.insert(0, element[1])
-    log.info(f'The queue at version {state} is {queue_copy}.')
+    log_items.info('The queue at version %s is %s.', state, queue_copy)
     print(queue_copy)
 
 
@@ -225,7 +238,174 @@ def process_queue_with_memory(args):
             print_noncompute(element[1])
 
 
-def process_queue(args, mode):
+def index_versions(args):
+    """
+    Replay the operations once, only counting. Since the queue is first in first out, the queue after ``k``
+    enqueues/dequeues is the slice ``[dequeues, enqueues)`` of the sequence of all the enqueued elements, so the
+    checkpoint of a version is just its number of dequeues. As in COMPUTE, a version counts the enqueues and dequeues
+    only, a version after the current one is the current queue, and a negative version counts back from the current
+    one.
+    Parameters
+    ----------
+    args: list
+        The list of arguments
+
+    Returns
+    -------
+    dict
+        The enqueued ``elements``, the ``checkpoints`` (number of dequeues after every version, as an array), the
+        ``prints`` as (version asked, version resolved) tuples and the ``error`` that stopped the replay (None if
+        none). The prints are the ones before the error
+    """
+    elements = []
+    checkpoints = array('q', [0])
+    prints = []
+    error = None
+    for element in args:
+        if element[0].lower() == 'e':
+            elements.append(element[1])
+            checkpoints.append(checkpoints[-1])
+        elif element[0].lower() == 'd':
+            if checkpoints[-1] == len(elements):
+                error = ValueError(f'Cannot dequeue from an empty queue at operation {len(checkpoints)}')
+                break
+            checkpoints.append(checkpoints[-1] + 1)
+        elif element[0].lower() == 'p':
+            version, current = int(element[1]), len(checkpoints) - 1
+            prints.append((element[1], min(version, current) if version >= 0 else max(current + version, 0)))
+    return {'elements': elements, 'checkpoints': checkpoints, 'prints': prints, 'error': error}
+
+
+def create_shared_array(values):
+    """
+    Copy an array into a new shared memory block
+    Parameters
+    ----------
+    values: array.array or bytes
+        The values
+
+    Returns
+    -------
+    shared_memory.SharedMemory
+        The shared memory block, which the caller has to close and unlink
+    """
+    data = memoryview(values).cast('B')
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    block.buf[:len(data)] = data
+    return block
+
+
+def create_element_buffers(elements):
+    """
+    Put the enqueued elements into shared memory, as printed in a list (``'a', 'b'``), with the byte offset of every
+    element. The text of the queue at any version is then a single slice of the shared memory.
+    Parameters
+    ----------
+    elements: list
+        The enqueued elements, in order
+
+    Returns
+    -------
+    tuple
+        The shared memory blocks of the text and of the offsets (``len(elements) + 1`` int64, where the last one is
+        the end of the text plus the separator), and the offsets themselves
+    """
+    encoded = [repr(element).encode() for element in elements]
+    offsets = array('q', itertools.accumulate((len(e) + 2 for e in encoded), initial=0))
+    return create_shared_array(b', '.join(encoded)), create_shared_array(offsets), offsets
+
+
+def materialize_versions(task):
+    """
+    Write the printed queues of a range of prints into the shared output, at their precomputed positions. Runs in
+    the worker processes, and only copies slices of shared memory.
+    Parameters
+    ----------
+    task: dict
+        The names of the shared ``text``, ``offsets`` (see ``create_element_buffers``) and ``output`` blocks, and the
+        ``prints`` of the range as (position in the output, first element, end element) tuples
+
+    Returns
+    -------
+    int
+        Number of prints written
+    """
+    blocks = [shared_memory.SharedMemory(name=task[name]) for name in ['text', 'offsets', 'output']]
+    text, output = blocks[0].buf, blocks[2].buf
+    offsets = blocks[1].buf.cast('q')
+    try:
+        for position, head, tail in task['prints']:
+            output[position] = ord('[')
+            # The text of the elements ends with a separator, which is left out
+            length = max(offsets[tail] - offsets[head] - 2, 0)
+            output[position + 1:position + 1 + length] = text[offsets[head]:offsets[head] + length]
+            output[position + 1 + length:position + 3 + length] = b']\n'
+        return len(task['prints'])
+    finally:
+        del text, output
+        offsets.release()
+        for block in blocks:
+            block.close()
+
+
+def process_queue_in_parallel(args, workers=None):
+    """
+    Here, the operations are replayed once, only counting (see ``index_versions``), which gives the first and end
+    element of every printed version, and so the position of every printed queue in the output. The prints are
+    partitioned in ranges of about the same output size, and the ranges are written into a shared output by a pool
+    of processes sharing the enqueued elements (see ``create_element_buffers``). The queues are printed in the order
+    of the prints, exactly as in COMPUTE.
+    Parameters
+    ----------
+    args:
+        The list of arguments
+    workers: int
+        Number of worker processes. Defaults to the number of CPUs. With 1 worker everything runs in this process
+
+    Returns
+    -------
+    None
+    """
+    index = index_versions(args)
+    checkpoints = index['checkpoints']
+    text_block, offsets_block, offsets = create_element_buffers(index['elements'])
+    prints = []
+    size = 0
+    for _, version in index['prints']:
+        head, tail = checkpoints[version], version - checkpoints[version]
+        prints.append((size, head, tail))
+        # "[" + the elements + "]\n"
+        size += max(offsets[tail] - offsets[head] - 2, 0) + 3
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(prints)))
+    # A few ranges per worker, cut at the print closest to an equal share of the output
+    ranges = workers * 4 if workers > 1 else 1
+    cuts = [bisect.bisect_left(prints, (size * number // ranges,)) for number in range(ranges)] + [len(prints)]
+    output_block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        tasks = [{'text': text_block.name, 'offsets': offsets_block.name, 'output': output_block.name,
+                  'prints': prints[start:end]} for start, end in zip(cuts, cuts[1:]) if end > start]
+        if workers == 1:
+            list(map(materialize_versions, tasks))
+        else:
+            log.debug(f'Materializing {len(prints)} versions in {len(tasks)} ranges with {workers} processes')
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(materialize_versions, tasks))
+        ends = [position for position, _, _ in prints[1:]] + [size]
+        for (state, _), (position, _, _), end in zip(index['prints'], prints, ends):
+            # Without the new line, which print adds back
+            line = bytes(output_block.buf[position:end - 1]).decode()
+            log_items.info('The queue at version %s is %s.', state, line)
+            print(line)
+    finally:
+        for block in [output_block, offsets_block, text_block]:
+            block.close()
+            block.unlink()
+    if index['error'] is not None:
+        raise index['error']
+
+
+def process_queue(args, mode, workers=None):
     """
     Process the queue
     Parameters
@@ -234,6 +414,8 @@ def process_queue(args, mode):
         List of arguments passed to the script
     mode:
         The mode to run the script in
+    workers: int
+        Number of worker processes, in PARALLEL mode only
 
     Returns
     -------
@@ -245,6 +427,8 @@ def process_queue(args, mode):
         process_queue_with_disk(args)
     elif mode == Mode.MEMORY:
         process_queue_with_memory(args)
+    elif mode == Mode.PARALLEL:
+        process_queue_in_parallel(args, workers)
 
 
 def validate_args(args):
@@ -277,16 +461,17 @@ def main():
     try:
         log.info("Starting main() function")
         # ===== Step 1: Get all the parameters from the console =====
+        options = parse_options()
         args = parse_args()
         validate_args(args)
         args = sanitise_args(args)
-        process_queue(args, Mode.COMPUTE)
+        process_queue(args, Mode[options['mode'].upper()], options['workers'])
 
     except Exception as error:
         log.exception(error)
 
     finally:
-        logging.shutdown()
+        shutdown_logging()
 
 
 if __name__ == '__main__':
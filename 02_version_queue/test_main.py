@@ -1,6 +1,9 @@
 import unittest
 import main
 import sys
+import io
+import random
+from unittest import mock
 
 
 class TestVersionQueue(unittest.TestCase):
@@ -31,10 +34,48 @@ class TestVersionQueue(unittest.TestCase):
             self.assertIn("['1', '4']", captured.records[0].message)
             self.assertIn("['4', '5']", captured.records[1].message)
 
+    def test_parallel(self):
+        with self.assertLogs() as captured:
+            main.process_queue(self.arguments, main.Mode.PARALLEL, workers=2)
+            self.assertEqual(len(captured.records), 2)
+            self.assertIn("['1', '4']", captured.records[0].message)
+            self.assertIn("['4', '5']", captured.records[1].message)
+
+    def test_parallel_matches_compute(self):
+        rng = random.Random(0)
+        arguments = []
+        size = 0
+        for i in range(2000):
+            if rng.random() < 0.5:
+                arguments.append(f'e {rng.choice(["a", "b", "ü"])}{i}')
+                size += 1
+            elif rng.random() < 0.5 and size > 0:
+                arguments.append('d')
+                size -= 1
+            else:
+                # Versions after the current one, and negative ones, are allowed as well
+                arguments.append(f'p {rng.randint(-10, i + 10)}')
+        arguments = main.sanitise_args(arguments)
+
+        outputs = []
+        for mode, workers in [(main.Mode.COMPUTE, None), (main.Mode.PARALLEL, 1), (main.Mode.PARALLEL, 3)]:
+            main.queue = []
+            with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout, self.assertLogs() as captured:
+                main.process_queue(arguments, mode, workers)
+            outputs.append((stdout.getvalue(), [record.message for record in captured.records
+                                                if record.name == 'version_queue.items']))
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], outputs[0])
+
+    def test_unknown_option(self):
+        with mock.patch.object(sys, 'argv', ['main.py', '--wokers', '4']), \
+                mock.patch('sys.stderr', new_callable=io.StringIO), self.assertRaises(SystemExit):
+            main.parse_options()
+
     def test_compute_using_stdin(self):
         stdin = sys.stdin
         sys.stdin = open('input.txt', 'r')
-        with self.assertLogs() as captured:
+        with mock.patch.object(sys, 'argv', ['main.py']), self.assertLogs() as captured:
             main.main()
             self.assertEqual(len(captured.records), 3)
             self.assertIn("['1', '4']", captured.records[1].message)
@@ -0,0 +1,213 @@
+"""
+Benchmarks the full position reconciliation pipeline (```main.main()```) on synthetic data generated with
+```generate_data.py```, and reports the rows parsed per second and the peak memory.
+
+The SFTP servers are replaced by a local stand-in, which "uploads" the PositionLimits.cfg files into
+```<data_folder>/servers/<host>/<folder>```, so the benchmark runs without any server and the uploaded files
+can be inspected afterwards.
+
+1. Run the file by executing
+    ```python.exe 03_position_reconciliation/benchmark.py --servers 10 --strategies 20 --instruments 1000 --rows 100000```
+    assuming your working directory is "AlphaGrepTakeHomeTest".
+2. ```-o <data_folder>``` keeps the generated data in that folder, instead of a temporary folder. Every other
+parameter of ```generate_data.py``` is accepted as well.
+3. ```-w <workers>```, ```--chunk_size <rows>``` and ```--profile``` are passed to the reconciliation as is.
+"""
+
+import sys
+import os
+import logging
+import tempfile
+import argparse
+import shutil
+import time
+import tracemalloc
+from unittest import mock
+import main as position_reconciliation
+import generate_data
+
+
+class LocalSFTPConnection:
+    """
+    Local stand-in for the subset of ``common.transport.SFTPSession`` used by the reconciliation. The remote paths
+    of a host are mapped to a folder on the local machine.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.uploads = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+    def _local_path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def exists(self, remote_path):
+        return os.path.exists(self._local_path(remote_path))
+
+    @property
+    def sftp_client(self):
+        return self
+
+    # The stand-in is its own SFTP client, channel and SSH transport
+    def get_channel(self):
+        return self
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return not self.closed
+
+    def stat(self, remote_path):
+        return os.stat(self._local_path(remote_path))
+
+    def put(self, local_path, remote_path):
+        shutil.copyfile(local_path, self._local_path(remote_path))
+        self.uploads += 1
+
+    def remove(self, remote_path):
+        os.remove(self._local_path(remote_path))
+
+    def posix_rename(self, old_path, new_path):
+        os.replace(self._local_path(old_path), self._local_path(new_path))
+
+    def open(self, remote_path, mode='r'):
+        return open(self._local_path(remote_path), mode)
+
+
+def parse_args():
+    """
+    Parses the arguments given to the script
+    Returns
+    -------
+    dictionary: A dictionary object containing the arguments passed
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the position reconciliation.')
+    parser.add_argument("-o", "--output_dir", help="The folder to generate the data in, a temporary one if not given",
+                        default=None, type=str)
+    parser.add_argument("--servers", help="Number of servers, one summary file each",
+                        default=3, type=int)
+    parser.add_argument("--strategies", help="Number of strategies",
+                        default=5, type=int)
+    parser.add_argument("--instruments", help="Number of instruments",
+                        default=100, type=int)
+    parser.add_argument("--rows", help="Number of rows per summary file",
+                        default=10000, type=int)
+    parser.add_argument("--bad_fraction", help="Fraction of summary lines with an extra trailing column",
+                        default=0.0, type=float)
+    parser.add_argument("--seed", help="Seed of the random generator",
+                        default=0, type=int)
+    parser.add_argument("-w", "--workers", help="Number of processes used to parse the summary files",
+                        default=None, type=int)
+    parser.add_argument("--chunk_size", help="Read the summary files this many rows at a time, summing as it goes",
+                        default=None, type=int)
+    parser.add_argument("--profile", help="Print the timing of every stage of the reconciliation",
+                        action='store_true')
+
+    return vars(parser.parse_args())
+
+
+def run_benchmark(data, workers=None, profile=False, chunk_size=None):
+    """
+    Run the whole reconciliation, for all the names, against the local SFTP stand-in
+    Parameters
+    ----------
+    data: dict
+        The generated data, see ``generate_data.generate_data``
+    workers: int
+        Number of processes used to parse the summary files
+    profile: bool
+        Whether to profile the stages of the reconciliation
+    chunk_size: int
+        Number of rows read at once from the summary files, all at once if None
+
+    Returns
+    -------
+    dict
+        The ``rows``, ``wall`` time, ``rows_per_second``, ``peak_memory`` (of this process, in bytes) and number of
+        ``uploads``. Raises ``RuntimeError`` if the reconciliation failed or uploaded nothing, rather than
+        reporting the numbers of a run that did not complete
+    """
+    servers_root = os.path.join(os.path.dirname(data['directory']), 'servers')
+    connections = {}
+    for host, folders in position_reconciliation.generate_directory_config_dict(data['directory']).items():
+        for folder in folders:
+            os.makedirs(os.path.join(servers_root, host, folder.strip().lstrip('/')), exist_ok=True)
+        connections[host] = LocalSFTPConnection(os.path.join(servers_root, host))
+
+    argv = ['main.py', '-a', '-c', data['configuration'], '-d', data['directory'], '-s', ','.join(data['summary'])]
+    if workers is not None:
+        argv += ['-w', str(workers)]
+    if profile:
+        argv += ['--profile']
+    if chunk_size is not None:
+        argv += ['--chunk_size', str(chunk_size)]
+
+    rows = 0
+    for summary_file in data['summary']:
+        with open(summary_file, 'rb') as f:
+            rows += sum(1 for line in f if line.strip())
+
+    position_reconciliation.log = logging.getLogger('position_reconciliation_benchmark')
+    tracemalloc.start()
+    try:
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(position_reconciliation, 'connect_to_server',
+                                  side_effect=lambda host: connections[host]):
+            start = time.perf_counter()
+            result = position_reconciliation.main()
+            wall = time.perf_counter() - start
+        if result != 0:
+            raise RuntimeError('The reconciliation failed, see the log above')
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        if position_reconciliation.profile_stages is not None:
+            # The profiler resets the peak at every stage, the peak of the run is the highest of all the stages
+            peak_memory = max([peak_memory] + [stage['peak_memory']
+                                               for stage in position_reconciliation.profile_stages.values()])
+    finally:
+        position_reconciliation.profile_stages = None
+        tracemalloc.stop()
+
+    uploads = sum(connection.uploads for connection in connections.values())
+    if not uploads:
+        raise RuntimeError('The reconciliation uploaded no position limits')
+    return {'rows': rows, 'wall': wall, 'rows_per_second': rows / wall, 'peak_memory': peak_memory,
+            'uploads': uploads}
+
+
+def main():
+    """
+    The main function of the program containing the business logic
+    Returns
+    -------
+    int: Returns 0 if program runs successfully, or returns 1
+    """
+    args = parse_args()
+    generate_data.validate_parameters({**args, 'output_dir': args.get('output_dir') or ''})
+    output_dir = args.get('output_dir') or tempfile.mkdtemp(prefix='position_reconciliation_benchmark_')
+
+    generate_start = time.perf_counter()
+    data = generate_data.generate_data(output_dir, args['servers'], args['strategies'], args['instruments'],
+                                       args['rows'], args['bad_fraction'], args['seed'])
+    print(f'Generated data in {output_dir} in {time.perf_counter() - generate_start:.2f}s')
+
+    result = run_benchmark(data, args.get('workers'), args.get('profile'), args.get('chunk_size'))
+    print(f'Rows: {result["rows"]}, wall: {result["wall"]:.3f}s, rows/s: {result["rows_per_second"]:,.0f}, '
+          f'peak memory: {result["peak_memory"] / (1024 * 1024):.1f} MB, uploads: {result["uploads"]}')
+
+    if args.get('output_dir') is None:
+        shutil.rmtree(output_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
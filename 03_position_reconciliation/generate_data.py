@@ -0,0 +1,240 @@
+"""
+Generates synthetic, large scale input for the position reconciliation: one ```<ip>_Summary``` file per server,
+a ```PositionLimits_Start.cfg``` and a ```directory``` file, in the same format as the files in ```Problem3```.
+
+Every server runs every strategy, with a log file named ```out_<strategy>_Part<server>``` and a folder named
+```/home/user/<strategy>_Part<server>/``` in the directory file. The strategy names have a fixed width, so that no
+strategy name is a substring of another one. A fraction of the summary lines can be made ragged, that is, with an
+extra trailing column like the ```unhedged``` line in ```Problem3/20.30.40.52_Summary```.
+
+1. Run the file by executing
+    ```python.exe 03_position_reconciliation/generate_data.py -o <output_folder> --servers 10 --strategies 20 --instruments 1000 --rows 100000 --bad_fraction 0.01```
+    assuming your working directory is "AlphaGrepTakeHomeTest".
+"""
+
+import sys
+import os
+import argparse
+import numpy as np
+
+LIMIT_TYPES = ['MAXLONGPOS', 'MAXSHORTPOS', 'MAXLONGEXPOSURE', 'MAXSHORTEXPOSURE']
+
+
+def parse_args():
+    """
+    Parses the arguments given to the script
+    Returns
+    -------
+    dictionary: A dictionary object containing the arguments passed
+    """
+    parser = argparse.ArgumentParser(description='Generate synthetic position reconciliation input.')
+    parser.add_argument("-o", "--output_dir", help="The folder to generate the files in",
+                        default=None, type=str)
+    parser.add_argument("--servers", help="Number of servers, one summary file each",
+                        default=3, type=int)
+    parser.add_argument("--strategies", help="Number of strategies",
+                        default=5, type=int)
+    parser.add_argument("--instruments", help="Number of instruments",
+                        default=100, type=int)
+    parser.add_argument("--rows", help="Number of rows per summary file",
+                        default=10000, type=int)
+    parser.add_argument("--bad_fraction", help="Fraction of summary lines with an extra trailing column",
+                        default=0.0, type=float)
+    parser.add_argument("--seed", help="Seed of the random generator",
+                        default=0, type=int)
+
+    return vars(parser.parse_args())
+
+
+def validate_parameters(args):
+    """
+    This function validates the parameters passed to the script
+    Parameters
+    ----------
+    args: dict
+        Contains a dictionary of all the parameters that are needed to run the script.
+
+    Returns
+    -------
+    None
+    """
+    if args.get('output_dir') is None:
+        raise ValueError('No output folder given to the script')
+    for count in ['servers', 'strategies', 'instruments', 'rows']:
+        if args.get(count) < 1:
+            raise ValueError(f'{count} must be at least 1')
+    if not 0 <= args.get('bad_fraction') <= 1:
+        raise ValueError('bad_fraction must be between 0 and 1')
+
+
+def get_server_ip(index):
+    """
+    Get the (fake) IP address of a server
+    Parameters
+    ----------
+    index: int
+        Index of the server
+
+    Returns
+    -------
+    str
+        The IP address
+    """
+    return f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}'
+
+
+def get_strategy_names(strategies):
+    """
+    Get the fixed width strategy names, so that no name is a substring of another
+    Parameters
+    ----------
+    strategies: int
+        Number of strategies
+
+    Returns
+    -------
+    list
+        The strategy names
+    """
+    width = len(str(strategies - 1))
+    return [f'STRAT{index:0{width}d}' for index in range(strategies)]
+
+
+def get_instrument_names(instruments):
+    """
+    Get the instrument names, formatted like ``NSE_FO_<symbol>_<expiry>``
+    Parameters
+    ----------
+    instruments: int
+        Number of instruments
+
+    Returns
+    -------
+    list
+        The instrument names
+    """
+    return [f'NSE_FO_SYM{index // 2}_{1703 + index % 2}' for index in range(instruments)]
+
+
+def generate_summary_file(summary_file, server_index, strategy_names, instrument_names, rows, bad_fraction, rng):
+    """
+    Generate the summary file of a server. The lines are grouped by log file, with a blank line between the groups,
+    and have the 11 columns of the real summary files (only the 1st, 2nd and 4th are used by the reconciliation).
+    Parameters
+    ----------
+    summary_file: str
+        Path of the summary file to write
+    server_index: int
+        Index of the server
+    strategy_names: list
+        The strategy names
+    instrument_names: list
+        The instrument names
+    rows: int
+        Number of rows in the file
+    bad_fraction: float
+        Fraction of lines with an extra trailing column
+    rng: np.random.Generator
+        The random generator
+
+    Returns
+    -------
+    None
+    """
+    strategies = np.sort(rng.integers(0, len(strategy_names), rows))
+    instruments = rng.integers(0, len(instrument_names), rows)
+    positions = rng.integers(-10000, 10001, rows)
+    traded = rng.integers(-50000, 50001, rows)
+    prices = rng.uniform(10, 5000, (rows, 2)).round(2)
+    quantities = rng.integers(0, 100000, (rows, 2))
+    ragged = rng.random(rows) < bad_fraction
+
+    lines = []
+    for row in range(rows):
+        if row > 0 and strategies[row] != strategies[row - 1]:
+            lines.append('')
+        line = (f'out_{strategy_names[strategies[row]]}_Part{server_index:<10} '
+                f'{instrument_names[instruments[row]]:<18} '
+                f'{traded[row]:<9} {positions[row]:<10} {prices[row, 0]:<11} {quantities[row, 0]:<9} '
+                f'{prices[row, 1]:<11} {quantities[row, 1]:<9} {(row % 10000) / 100:.2f}%    '
+                f'{prices[row, 0] * quantities[row, 0]:.1f}  {positions[row] / 100:.2f}')
+        if ragged[row]:
+            line += ' unhedged'
+        lines.append(line)
+
+    with open(summary_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def generate_data(output_dir, servers=3, strategies=5, instruments=100, rows=10000, bad_fraction=0.0, seed=0):
+    """
+    Generate the summary files, the position limits file and the directory file
+    Parameters
+    ----------
+    output_dir: str
+        The folder to generate the files in
+    servers: int
+        Number of servers, one summary file each
+    strategies: int
+        Number of strategies
+    instruments: int
+        Number of instruments
+    rows: int
+        Number of rows per summary file
+    bad_fraction: float
+        Fraction of summary lines with an extra trailing column
+    seed: int
+        Seed of the random generator
+
+    Returns
+    -------
+    dict
+        The paths of the generated ``summary`` files (list), ``configuration`` and ``directory`` files, and the
+        ``hosts`` and ``names`` used
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    strategy_names = get_strategy_names(strategies)
+    instrument_names = get_instrument_names(instruments)
+    hosts = [get_server_ip(index) for index in range(servers)]
+
+    summary_files = []
+    for server_index, host in enumerate(hosts):
+        summary_file = os.path.join(output_dir, f'{host}_Summary')
+        generate_summary_file(summary_file, server_index, strategy_names, instrument_names, rows, bad_fraction, rng)
+        summary_files.append(summary_file)
+
+    configuration = os.path.join(output_dir, 'PositionLimits_Start.cfg')
+    limits = rng.integers(1, 50, instruments) * 10000
+    with open(configuration, 'w') as f:
+        f.writelines(f'{instrument}_{limit_type} = {limit * (2 if "EXPOSURE" in limit_type else 1)}\n'
+                     for instrument, limit in zip(instrument_names, limits) for limit_type in LIMIT_TYPES)
+
+    directory = os.path.join(output_dir, 'directory')
+    with open(directory, 'w') as f:
+        for server_index, host in enumerate(hosts):
+            f.write(f'[{host}]\n')
+            f.writelines(f'/home/user/{strategy}_Part{server_index}/\n' for strategy in strategy_names)
+
+    return {'summary': summary_files, 'configuration': configuration, 'directory': directory, 'hosts': hosts,
+            'names': strategy_names}
+
+
+def main():
+    """
+    The main function of the program containing the business logic
+    Returns
+    -------
+    int: Returns 0 if program runs successfully, or returns 1
+    """
+    args = parse_args()
+    validate_parameters(args)
+    generated = generate_data(args['output_dir'], args['servers'], args['strategies'], args['instruments'],
+                              args['rows'], args['bad_fraction'], args['seed'])
+    print(f'Generated {len(generated["summary"])} summary files, {generated["configuration"]} and '
+          f'{generated["directory"]}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
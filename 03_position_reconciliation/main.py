@@ -4,27 +4,110 @@ This one has only one assumption. The assumption is that the id_rsa file is ```P
 for password-less login. I've tested this on WSL machine, and it works with my username ```osama```.
 Therefore, the code does contain a "hard-coded" ```username='osama``` and ```private_key=Problem3\id_rsa```
 
-The other most important thing is that this needs ```pandas>1.4.0``` (fulfilled with requirements.txt)
-since that version has a callable for ```bad_lines``` which is there in one of the summary files.
+The other most important thing is that this needs ```pandas>=1.4.0``` (fulfilled with requirements.txt).
+The summary files are read with the C engine of ```read_csv``` converting only the columns of interest, which
+also tolerates the ragged (extra trailing column) lines which are there in one of the summary files.
 
-Script requires pysftp for the sftp operations. Before running script, please run
+Script requires paramiko for the sftp operations. Before running script, please run
 ```python.exe -m pip install -r 03_position_reconciliation/requirements.txt```
 
 1. Run the file by executing (python 3 required since f-strings are used!)
     ```python.exe 03_position_reconciliation/main.py -n <name> -c <config_file> -d <directory_file> -s <summary1,summary2,summary3>```
     assuming your working directory is "AlphaGrepTakeHomeTest".
+2. ```-w <workers>``` is optional, and is the number of processes used to parse the summary files concurrently.
+    It defaults to the number of CPUs. The result is the same (and in the same order) irrespective of the workers.
+3. ```-n``` also takes a comma separated list of names (```-n GFD,LIMIT```), and ```-a``` reconciles every name
+    derived from the folders in the directory file (the folder name without the ```_Part<N>``` suffix). All the
+    names are reconciled in one pass over the summary, and a PositionLimits.cfg is generated for each of them.
+    If a folder or a log file contains more than one name (```NEWFUTURES``` contains ```FUTURES```), the longest
+    name wins.
+4. ```-f``` runs the script in follow mode. It keeps reading the rows appended to the summary files (from the last
+    byte offset read), updates the positions in memory and pushes a new PositionLimits.cfg only for the names whose
+    net position changed. ```--debounce <seconds>``` (default 5) is the minimum time between two pushes for the same
+    name and ```--poll_interval <seconds>``` (default 1) is how often the summary files are read. Stop it with Ctrl+C.
+5. ```-t <transfer_workers>``` is optional, and is the number of servers the PositionLimits.cfg is transferred to at
+    the same time (default: number of servers, up to 8). Every server gets a single SFTP session for all its folders,
+    and a server that cannot be reached does not stop the transfer to the others (the failures are reported at the end).
+6. ```--cache_dir <folder>``` is optional, and caches the parsed columns of every summary file in that folder (as
+    ```.npz``` files, with the string columns categorical encoded). On the next run, summary files with the same size,
+    mtime and content hash are loaded from the cache, and only new or changed files are parsed.
+    ```--cache_max_size <MB>``` and ```--cache_max_age <hours>``` evict the least recently used entries.
+7. ```-r <remote_summary_path>``` reads the summary file of every server in the directory file straight over SFTP,
+    instead of ```-s```, e.g. ```-r /home/user/{host}_Summary``` (```{host}``` is replaced by the server). The servers
+    are read concurrently (up to ```-t``` at once) and nothing is written to disk. For testing,
+    ```--summary_source_dir <folder>``` stands in for the servers, e.g. ```-r {host}_Summary --summary_source_dir Problem3```
+8. ```--profile``` records the wall time, CPU time and peak memory of every stage (reading the summary, grouping,
+    consolidating positions, generating the cfg files and transferring them), and prints a timing table and a
+    JSON report at exit. ```--profile_dir <folder>``` turns the profiling on as well, and also writes a cProfile
+    (pstats) dump of every stage and the JSON report into that folder. A stage run many times (follow mode,
+    daemon) is summed up over all its runs.
+9. ```03_position_reconciliation/generate_data.py -o <folder> --servers <n> --strategies <n> --instruments <n> --rows <n> --bad_fraction <f>```
+    generates synthetic summary, PositionLimits_Start.cfg and directory files at scale, and
+    ```03_position_reconciliation/benchmark.py``` (same parameters) runs the whole reconciliation on them, for all
+    the names, against a local stand-in for the SFTP servers, and reports the rows/s and the peak memory.
+10. The PositionLimits.cfg is only uploaded when its content changed. It is compared (by content hash) with the file
+    on the server, or with the last push recorded in ```--publish_record <file.json>``` if given, which saves
+    reading the file back from the server. A changed file is uploaded to a temporary name and renamed over the live
+    PositionLimits.cfg, so the trading process never reads a half written file.
+11. ```--chunk_size <rows>``` reads every summary file that many rows at a time, with categorical LogfileName and
+    Instrument columns, and sums every chunk by (LogfileName, Instrument) straight away. The memory needed then
+    depends on the number of distinct (LogfileName, Instrument), and not on the number of rows.
+12. ```-D``` runs the script as a daemon, e.g. ```-D -c <config_file> -d <directory_file> [-s <summaries>] [--socket <path>]```.
+    It parses the position limits (and the summary files given) once, keeps the parsed summary files and the SFTP
+    sessions to the servers open between jobs, and reconciles the jobs sent to it on the Unix socket ```--socket```,
+    or else on ```127.0.0.1:<--port>``` (default 8765). A job only re-parses the summary files that changed, e.g.
+    ```curl --unix-socket <path> -d '{"name": "GFD", "summary": ["Problem3/20.30.40.51_Summary"]}' http://localhost/reconcile```
+    (```"all_names": true``` and ```"remote_summary"``` are accepted as well), and ```GET /status``` shows what is
+    kept warm. pandas, numpy and paramiko are only imported when first used, so ```--help``` returns straight away.
+13. Every server gets a single SSH connection for the whole run, shared through ```common/transport.py```: the
+    summary reads, the transfers and the daemon jobs open SFTP channels on it, and only the first one pays for the
+    key exchange and the authentication. ```--ssh_config <file.json>``` sets the credentials of the servers (the
+    user and key above by default), the known hosts file (```~/.ssh/known_hosts``` by default) and whether unknown
+    host keys are refused (the default) or trusted for the run (```"strict_host_keys": false```).
 """
 
 import sys
 import os
-import logging
 import tempfile
 import datetime
 import argparse
-import pandas as pd
-import pysftp
+import contextlib
+import cProfile
+import functools
+import hashlib
+import http.server
+import io
+import json
+import re
+import socket
+import socketserver
+import stat
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# The modules shared by all the tools live in the "common" package at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logger import init_logger as init_shared_logger, shutdown_logging  # noqa: E402
+from common.lazy_import import lazy_import, load_modules  # noqa: E402
+from common.transport import (load_config as load_ssh_config, open_sftp, set_credentials,  # noqa: E402
+                              set_host_key_options)
+
+# Importing these takes most of the start up time, they are only imported when first used. --help, a validation
+# failure or a job sent to the daemon (-D) do not pay for them
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 log = None
+# Running totals of every stage, only recorded with --profile (see init_profiler)
+profile_stages = None
+profile_dir = None
+# The open SFTP session of every server, kept across the jobs of the daemon only (see server_session)
+server_sessions = None
+
+# Only the 1st, 2nd and 4th column of a summary file are of interest (LogfileName, Instrument, Position)
+SUMMARY_COLUMNS = [0, 1, 3]
+SUMMARY_COLUMN_NAMES = ['LogfileName', 'Instrument', 'Position']
 
 
 def init_logger():
@@ -34,27 +117,96 @@ def init_logger():
     -------
     Logger object
     """
-    tempdir = tempfile.mkdtemp(
-        prefix=f'downloader_framework_{os.getpid()}__{datetime.datetime.now().strftime("%H_%M_%S")}')
-
-    logger = logging.getLogger('position_reconciliation')
-    logger.setLevel(logging.DEBUG)
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler(os.path.join(tempdir, 'logfile.log'))
-    fh.setLevel(logging.DEBUG)
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(filename)s:%(lineno)s - %(funcName)20s() - %(levelname)s - %(message)s')
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
-    # add the handlers to logger
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-
-    return logger
+    return init_shared_logger('position_reconciliation')
+
+
+def init_profiler(directory=None):
+    """
+    Start recording the wall time, CPU time and peak memory of every stage of the pipeline
+    Parameters
+    ----------
+    directory: str
+        If given, a cProfile (pstats) dump of every stage and the JSON report are written in it
+
+    Returns
+    -------
+    None
+    """
+    global profile_stages
+    global profile_dir
+    profile_stages = {}
+    profile_dir = directory
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+    tracemalloc.start()
+
+
+@contextlib.contextmanager
+def profile_stage(stage):
+    """
+    Context manager adding the wall time, CPU time and peak (python allocated) memory of a stage to the totals of
+    the stage. Does nothing unless the profiler was initialised. The CPU time is the one of this process only,
+    worker processes are not included. A stage run again and again (follow mode, daemon jobs) only updates its
+    totals and its cProfile profiler, so the memory used does not grow with the number of runs.
+    Parameters
+    ----------
+    stage: str
+        Name of the stage
+
+    Returns
+    -------
+    None
+    """
+    if profile_stages is None:
+        yield
+        return
+
+    totals = profile_stages.setdefault(stage, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory': 0,
+                                               'profiler': cProfile.Profile() if profile_dir is not None else None})
+    tracemalloc.reset_peak()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    if totals['profiler'] is not None:
+        totals['profiler'].enable()
+    try:
+        yield
+    finally:
+        if totals['profiler'] is not None:
+            totals['profiler'].disable()
+        totals['calls'] += 1
+        totals['wall'] += time.perf_counter() - start_wall
+        totals['cpu'] += time.process_time() - start_cpu
+        totals['peak_memory'] = max(totals['peak_memory'], tracemalloc.get_traced_memory()[1])
+
+
+def report_profile():
+    """
+    Print a timing table of all the stages and a JSON report. If there is a profile directory, the report and a
+    cProfile (pstats) dump of every stage, covering all its calls, are written to it
+    Returns
+    -------
+    dict
+        The JSON report
+    """
+    stages = {name: {key: value for key, value in totals.items() if key != 'profiler'}
+              for name, totals in profile_stages.items()}
+    report = {'timestamp': datetime.datetime.now().isoformat(), 'stages': stages,
+              'total_wall': sum(stage['wall'] for stage in stages.values()),
+              'total_cpu': sum(stage['cpu'] for stage in stages.values())}
+
+    table = [f'{"Stage":<20} {"Calls":>6} {"Wall (s)":>10} {"CPU (s)":>10} {"Peak (MB)":>10}']
+    for name, stage in stages.items():
+        table.append(f'{name:<20} {stage["calls"]:>6} {stage["wall"]:>10.4f} {stage["cpu"]:>10.4f} '
+                     f'{stage["peak_memory"] / (1024 * 1024):>10.2f}')
+    table.append(f'{"total":<20} {"":>6} {report["total_wall"]:>10.4f} {report["total_cpu"]:>10.4f}')
+    print('\n'.join(table))
+    print(json.dumps(report))
+
+    if profile_dir is not None:
+        for name, totals in profile_stages.items():
+            totals['profiler'].dump_stats(os.path.join(profile_dir, f'{name}.pstats'))
+        with open(os.path.join(profile_dir, 'profile_report.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
 
 
 def validate_parameters(args):
@@ -72,7 +224,9 @@ def validate_parameters(args):
 
     """
     log.info("Validating parameters")
-    if args.get('name') is None:
+    # The daemon gets the names and the summary files with every job
+    daemon = args.get('daemon')
+    if args.get('name') is None and not args.get('all_names') and not daemon:
         raise ValueError("Name is needed for remoting to the machine")
     if args.get('configuration') is None:
         raise ValueError('No configuration file given to the script.')
@@ -82,12 +236,44 @@ def validate_parameters(args):
         raise ValueError('No directory file given to the script.')
     if not os.path.isfile(args.get('directory')):
         raise FileNotFoundError('directory File not found')
-    if args.get('summary') is None:
-        raise ValueError('No summary file given to the script')
-    summary_files = args.get('summary').split(',')
-    for f in summary_files:
-        if not os.path.isfile(f):
-            raise FileNotFoundError(f'No summary file {f} found')
+    if daemon:
+        if args.get('follow'):
+            raise ValueError('Follow mode cannot be used with the daemon')
+        if args.get('socket') is not None and not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('Unix sockets are not supported on this platform, use --port instead')
+        if args.get('port') is not None and not 0 <= args.get('port') <= 65535:
+            raise ValueError('Port must be between 0 and 65535')
+    if args.get('remote_summary') is not None:
+        if args.get('follow'):
+            raise ValueError('Follow mode needs local summary files')
+        if args.get('summary_source_dir') is not None and not os.path.isdir(args.get('summary_source_dir')):
+            raise FileNotFoundError(f'Summary source folder {args.get("summary_source_dir")} not found')
+    elif args.get('summary') is None:
+        if not daemon:
+            raise ValueError('No summary file given to the script')
+    else:
+        summary_files = args.get('summary').split(',')
+        for f in summary_files:
+            if not os.path.isfile(f):
+                raise FileNotFoundError(f'No summary file {f} found')
+    if args.get('ssh_config') is not None and not os.path.isfile(args.get('ssh_config')):
+        raise FileNotFoundError(f'SSH config file {args.get("ssh_config")} not found')
+    if args.get('workers') is not None and args.get('workers') < 1:
+        raise ValueError('Number of workers must be at least 1')
+    if args.get('transfer_workers') is not None and args.get('transfer_workers') < 1:
+        raise ValueError('Number of transfer workers must be at least 1')
+    if args.get('chunk_size') is not None:
+        if args.get('chunk_size') < 1:
+            raise ValueError('Chunk size must be at least 1')
+        if args.get('cache_dir') is not None:
+            raise ValueError('The summary cache cannot be used with a chunk size')
+    for cache_limit in ['cache_max_size', 'cache_max_age']:
+        if args.get(cache_limit) is not None and args.get(cache_limit) < 0:
+            raise ValueError(f'{cache_limit} cannot be negative')
+    if args.get('debounce') is not None and args.get('debounce') < 0:
+        raise ValueError('Debounce interval cannot be negative')
+    if args.get('poll_interval') is not None and args.get('poll_interval') <= 0:
+        raise ValueError('Poll interval must be positive')
 
 
 def sanitise_args(args):
@@ -104,7 +290,20 @@ def sanitise_args(args):
     None
     """
     log.info("Sanitising Arguments ")
-    args['summary'] = args.get('summary').split(',')
+    if args.get('summary') is not None:
+        args['summary'] = args.get('summary').split(',')
+    if args.get('cache_max_size') is not None:
+        args['cache_max_size'] = int(args['cache_max_size'] * 1024 * 1024)
+    if args.get('cache_max_age') is not None:
+        args['cache_max_age'] = args['cache_max_age'] * 3600
+    if args.get('all_names'):
+        args['names'] = derive_names_from_directory(generate_directory_config_dict(args.get('directory')))
+    elif args.get('name') is not None:
+        args['names'] = [name.strip() for name in args.get('name').split(',') if name.strip()]
+    else:
+        args['names'] = []
+    if not args['names'] and not args.get('daemon'):
+        raise ValueError('No name to reconcile positions for')
 
 
 def parse_args():
@@ -115,56 +314,477 @@ def parse_args():
     dictionary: A dictionary object containing the arguments passed
     """
     parser = argparse.ArgumentParser(description='Process some integers.')
-    parser.add_argument("-n", "--name", help="The Name to reconcile positions for",
+    parser.add_argument("-n", "--name", help="The Name (or comma separated Names) to reconcile positions for",
                         default=None, type=str)
+    parser.add_argument("-a", "--all_names", help="Reconcile every Name derived from the directory file",
+                        action='store_true')
     parser.add_argument("-c", "--configuration", help="The full path to configuration file",
                         default=None, type=str)
     parser.add_argument("-d", "--directory", help="The directory where one needs to upload this file",
                         default=None, type=str)
     parser.add_argument("-s", "--summary", help="Comma separated list of summary files",
                         default=None, type=str)
+    parser.add_argument("-f", "--follow", help="Keep following the summary files and push limits as they change",
+                        action='store_true')
+    parser.add_argument("--debounce", help="Minimum seconds between two pushes of the same name in follow mode",
+                        default=5.0, type=float)
+    parser.add_argument("--poll_interval", help="Seconds between two reads of the summary files in follow mode",
+                        default=1.0, type=float)
+    parser.add_argument("-t", "--transfer_workers", help="Number of servers connected to at once",
+                        default=None, type=int)
+    parser.add_argument("-r", "--remote_summary",
+                        help="Path of the summary file on every server in the directory file, read over SFTP instead "
+                             "of local summary files. {host} is replaced by the server",
+                        default=None, type=str)
+    parser.add_argument("--summary_source_dir", help="Local folder standing in for the servers with --remote_summary",
+                        default=None, type=str)
+    parser.add_argument("--publish_record", help="JSON file recording the content hash of the last push to every "
+                                                 "folder, to skip unchanged files without reading them back",
+                        default=None, type=str)
+    parser.add_argument("--chunk_size", help="Read the summary files this many rows at a time, summing as it goes",
+                        default=None, type=int)
+    parser.add_argument("--cache_dir", help="Directory to cache the parsed summary files in",
+                        default=None, type=str)
+    parser.add_argument("--cache_max_size", help="Maximum size of the summary cache in MB",
+                        default=None, type=float)
+    parser.add_argument("--cache_max_age", help="Maximum hours a summary cache entry is kept unused",
+                        default=None, type=float)
+    parser.add_argument("--profile", help="Print the wall time, CPU time and peak memory of every stage at exit",
+                        action='store_true')
+    parser.add_argument("--profile_dir", help="Folder to write a cProfile dump of every stage and the JSON report to, "
+                                              "turns on --profile",
+                        default=None, type=str)
+    parser.add_argument("-w", "--workers", help="Number of processes used to parse the summary files",
+                        default=None, type=int)
+    parser.add_argument("--ssh_config", help="JSON file with the credentials of the servers and the known hosts",
+                        default=None, type=str)
+    parser.add_argument("-D", "--daemon", help="Keep running, and reconcile the jobs sent to --socket or --port",
+                        action='store_true')
+    parser.add_argument("--socket", help="Unix socket the daemon listens on for jobs",
+                        default=None, type=str)
+    parser.add_argument("--port", help="Port the daemon listens on for jobs (on 127.0.0.1) if there is no --socket",
+                        default=8765, type=int)
 
     return vars(parser.parse_args())
 
 
-def bad_line(line):
+def read_summary_file(summary_file):
+    """
+    Read a single summary file, keeping only the LogfileName, Instrument and Position columns.
+
+    The summary files are whitespace separated and some lines carry extra trailing columns (e.g. ``unhedged``).
+    Passing ``usecols`` to the C parser makes it tokenize the line but only convert the first, second and
+    fourth field, and it tolerates lines longer than the first one without a per line python callback.
+    Parameters
+    ----------
+    summary_file: str or file-like
+        Path to the summary file, or a buffer containing summary lines
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with typed LogfileName, Instrument and Position columns
+    """
+    summary_df = pd.read_csv(summary_file, header=None, sep=r'\s+', engine='c', usecols=SUMMARY_COLUMNS,
+                             dtype={0: str, 1: str, 3: 'float64'})
+    summary_df.columns = SUMMARY_COLUMN_NAMES
+    return summary_df
+
+
+def get_file_digest(file_path):
+    """
+    Get the content hash of a file
+    Parameters
+    ----------
+    file_path: str
+        Path to the file
+
+    Returns
+    -------
+    str
+        The hex digest of the file contents
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_summary_cache_file(cache_dir, summary_file):
     """
-    Function to process any bad lines
+    Get the path of the cache entry of a summary file. There is one entry per summary file path, which is
+    overwritten whenever the summary file changes.
     Parameters
     ----------
-    line: list
-        The delimiter separated list
+    cache_dir: str
+        The cache directory
+    summary_file: str
+        Path to the summary file
 
     Returns
     -------
+    str
+        Path to the .npz cache entry
+    """
+    path_digest = hashlib.blake2b(os.path.abspath(summary_file).encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f'{path_digest}.npz')
+
+
+def load_cached_summary_chunk(cache_file, summary_file):
+    """
+    Load the parsed columns of a summary file from the cache, if the summary file has not changed since. The size
+    and mtime are checked first, so the content hash is only computed when they match.
+    Parameters
+    ----------
+    cache_file: str
+        Path to the .npz cache entry
+    summary_file: str
+        Path to the summary file
+
+    Returns
+    -------
+    dict
+        A dictionary of column name to numpy array, or None if there is no valid cache entry
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    stat_result = os.stat(summary_file)
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            if (int(cached['size']) != stat_result.st_size or int(cached['mtime_ns']) != stat_result.st_mtime_ns or
+                    str(cached['digest']) != get_file_digest(summary_file)):
+                return None
+            # Missing values are stored with the code -1, which picks the NaN appended after the categories
+            chunk = {column: np.append(cached[f'{column}_categories'].astype(object), np.nan)[cached[f'{column}_codes']]
+                     for column in SUMMARY_COLUMN_NAMES[:2]}
+            chunk['Position'] = cached['Position']
+    except (OSError, ValueError, KeyError):
+        # A corrupt or an old format entry is treated as a miss, and gets overwritten
+        return None
+    # Keep track of the last use for the eviction
+    os.utime(cache_file)
+    return chunk
+
+
+def save_summary_chunk_to_cache(cache_file, summary_file, chunk, stat_result):
+    """
+    Save the parsed columns of a summary file into the cache. The string columns are stored categorical encoded
+    (codes and categories), and the entry is written to a temporary name first and renamed, so that a concurrent
+    reader never sees a half written entry.
+    Parameters
+    ----------
+    cache_file: str
+        Path to the .npz cache entry
+    summary_file: str
+        Path to the summary file
+    chunk: dict
+        A dictionary of column name to numpy array
+    stat_result: os.stat_result
+        The stat of the summary file taken before it was parsed
+
+    Returns
+    -------
+    None
+    """
+    arrays = {'size': np.int64(stat_result.st_size), 'mtime_ns': np.int64(stat_result.st_mtime_ns),
+              'digest': np.str_(get_file_digest(summary_file)), 'Position': chunk['Position']}
+    for column in SUMMARY_COLUMN_NAMES[:2]:
+        codes, categories = pd.factorize(chunk[column])
+        arrays[f'{column}_codes'] = codes.astype(np.int32)
+        arrays[f'{column}_categories'] = np.asarray(categories, dtype=str)
+
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temp_file, cache_file)
+
+
+def read_summary_chunk(summary_file, cache_dir=None):
+    """
+    Read a summary file into compact columnar arrays. This is what the worker processes return, since numpy
+    arrays are far cheaper to pickle back to the parent process than a DataFrame.
+    Parameters
+    ----------
+    summary_file: str
+        Path to the summary file
+    cache_dir: str
+        The cache directory of parsed summary files. Unchanged summary files are loaded from it instead of being
+        parsed again. No cache is used if None
+
+    Returns
+    -------
+    dict
+        A dictionary of column name to numpy array
+    """
+    if cache_dir is not None:
+        cache_file = get_summary_cache_file(cache_dir, summary_file)
+        chunk = load_cached_summary_chunk(cache_file, summary_file)
+        if chunk is not None:
+            return chunk
+        stat_result = os.stat(summary_file)
+
+    summary_df = read_summary_file(summary_file)
+    chunk = {column: summary_df[column].to_numpy() for column in SUMMARY_COLUMN_NAMES}
+
+    if cache_dir is not None:
+        save_summary_chunk_to_cache(cache_file, summary_file, chunk, stat_result)
+    return chunk
+
+
+def evict_summary_cache(cache_dir, max_size=None, max_age=None):
+    """
+    Evict entries from the cache of parsed summary files. Entries not used for more than ``max_age`` seconds are
+    removed first, then the least recently used entries are removed until the cache fits in ``max_size`` bytes.
+    Parameters
+    ----------
+    cache_dir: str
+        The cache directory
+    max_size: int
+        Maximum size of the cache in bytes. No limit if None
+    max_age: float
+        Maximum number of seconds since an entry was last used. No limit if None
+
+    Returns
+    -------
+    int
+        Number of entries evicted
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.npz'):
+            stat_result = entry.stat()
+            entries.append((stat_result.st_mtime, stat_result.st_size, entry.path))
+    # Most recently used first
+    entries.sort(reverse=True)
+
+    now = time.time()
+    evicted = 0
+    total_size = 0
+    for last_used, size, path in entries:
+        if (max_age is not None and now - last_used > max_age) or \
+                (max_size is not None and total_size + size > max_size):
+            os.remove(path)
+            evicted += 1
+        else:
+            total_size += size
+    if evicted:
+        log.info(f'Evicted {evicted} entries from the summary cache')
+    return evicted
+
+
+def aggregate_summary_file(summary_file, chunk_size):
+    """
+    Read a summary file in chunks of ``chunk_size`` rows, and reduce every chunk into a running
+    (LogfileName, Instrument) -> Position aggregate straight away. The strings are read as categoricals, so the
+    memory needed depends on the number of distinct (LogfileName, Instrument) and not on the number of rows.
+    Parameters
+    ----------
+    summary_file: str
+        Path to the summary file
+    chunk_size: int
+        Number of rows read at once
+
+    Returns
+    -------
+    dict
+        A dictionary of column name to numpy array, with one row per (LogfileName, Instrument)
+    """
+    aggregate = None
+    with pd.read_csv(summary_file, header=None, sep=r'\s+', engine='c', usecols=SUMMARY_COLUMNS,
+                     dtype={0: 'category', 1: 'category', 3: 'float64'}, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            chunk_aggregate = chunk.groupby([0, 1], observed=True, sort=False)[3].sum()
+            aggregate = chunk_aggregate if aggregate is None else aggregate.add(chunk_aggregate, fill_value=0)
+
+    if aggregate is None:
+        return {column: np.array([], dtype=dtype) for column, dtype in
+                zip(SUMMARY_COLUMN_NAMES, [object, object, 'float64'])}
+    return {'LogfileName': aggregate.index.get_level_values(0).to_numpy(dtype=object),
+            'Instrument': aggregate.index.get_level_values(1).to_numpy(dtype=object),
+            'Position': aggregate.to_numpy(dtype='float64')}
+
+
+def read_summary_chunks(summary_files_list, workers=None, cache_dir=None, chunk_size=None):
+    """
+    Read the summary files into columnar chunks. The summary files are parsed concurrently in a process pool, and
+    the chunks are in the same order as ``summary_files_list``.
+    Parameters
+    ----------
+    summary_files_list: list
+        List of summary files
+    workers: int
+        Number of worker processes to parse the summary files with. Defaults to the number of CPUs (capped at the
+        number of summary files). With 1 worker the files are parsed in the current process.
+    cache_dir: str
+        The cache directory of parsed summary files. Only new or changed summary files are parsed when given
+    chunk_size: int
+        If given, every summary file is read ``chunk_size`` rows at a time and already summed by
+        (LogfileName, Instrument), see ``aggregate_summary_file``. The cache is not used in this mode
+    Returns
+    -------
     list
-        The final list
+        A list of dictionaries of column name to numpy array, one per summary file
     """
-    return line[:11]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(summary_files_list)))
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    if chunk_size is not None:
+        read_function = functools.partial(aggregate_summary_file, chunk_size=chunk_size)
+    else:
+        read_function = functools.partial(read_summary_chunk, cache_dir=cache_dir)
+
+    if workers == 1:
+        return [read_function(f) for f in summary_files_list]
+    log.info(f"Parsing {len(summary_files_list)} summary files with {workers} worker processes")
+    # The workers are forked from this process: importing pandas and numpy first saves every worker (and then this
+    # process, to concatenate the chunks) from importing them again
+    load_modules(np, pd)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map yields results in the order of the input, keeping the result deterministic
+        return list(executor.map(read_function, summary_files_list))
 
 
-def get_consolidated_summary_df(summary_files_list):
+def get_consolidated_summary_df(summary_files_list, workers=None, cache_dir=None, chunk_size=None):
     """
-    Get a list of consolidated summary file dataframes
+    Get a list of consolidated summary file dataframes. The summary files are parsed concurrently (see
+    ``read_summary_chunks``) and the results are concatenated once at the end, in the same order as
+    ``summary_files_list``.
     Parameters
     ----------
     summary_files_list: list
         List of summary files
+    workers: int
+        Number of worker processes to parse the summary files with
+    cache_dir: str
+        The cache directory of parsed summary files
+    chunk_size: int
+        If given, every summary file is read ``chunk_size`` rows at a time and already summed
     Returns
     -------
     pd.DataFrame
         A DataFrames
     """
     log.info("Consolidating Summary")
-    consolidated_df = pd.DataFrame(columns=[0, 1, 3])
-    for f in summary_files_list:
-        consolidated_df = pd.concat([consolidated_df,
-                                     pd.read_csv(f, header=None, delim_whitespace=True, on_bad_lines=bad_line,
-                                                 engine='python')[[0, 1, 3]]],
-                                    ignore_index=True)
-    consolidated_df = consolidated_df.astype({3: float})
-    consolidated_df.columns = ['LogfileName', 'Instrument', 'Position']
-    return consolidated_df
+    return concat_summary_chunks(read_summary_chunks(summary_files_list, workers, cache_dir, chunk_size))
+
+
+def concat_summary_chunks(chunks):
+    """
+    Concatenate the columnar chunks of many summary files into a single DataFrame
+    Parameters
+    ----------
+    chunks: list
+        List of dictionaries of column name to numpy array
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with LogfileName, Instrument and Position columns
+    """
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in
+                             zip(SUMMARY_COLUMN_NAMES, [object, object, 'float64'])})
+    # A single concatenation per column, instead of growing a DataFrame file by file
+    return pd.DataFrame({column: np.concatenate([chunk[column] for chunk in chunks])
+                         for column in SUMMARY_COLUMN_NAMES})
+
+
+def read_remote_summary_chunk(host, remote_path, local_root=None):
+    """
+    Read the summary file of a server straight from the server. The SFTP file handle is given to the parser as
+    is, so the remote bytes are parsed as they arrive and nothing is written to disk.
+    Parameters
+    ----------
+    host: str
+        The server to read the summary file from
+    remote_path: str
+        Path of the summary file on the server
+    local_root: str
+        A local directory standing in for the servers (for testing). The remote path is read relative to it
+
+    Returns
+    -------
+    dict
+        A dictionary of column name to numpy array
+    """
+    if local_root is not None:
+        with open(os.path.join(local_root, remote_path.lstrip('/')), 'rb') as summary_file:
+            summary_df = read_summary_file(summary_file)
+    else:
+        with server_session(host) as sftp:
+            with sftp.open(remote_path, 'rb') as summary_file:
+                # Keep many read requests in flight instead of waiting on every block
+                summary_file.prefetch()
+                summary_df = read_summary_file(summary_file)
+    return {column: summary_df[column].to_numpy() for column in SUMMARY_COLUMN_NAMES}
+
+
+def collect_remote_summaries(directory, remote_summary_path, local_root=None, max_workers=None):
+    """
+    Collect the summary files of all the servers in the directory file over concurrent SFTP sessions, instead of
+    copying them locally first. The result is in the order of the servers in the directory file.
+    Parameters
+    ----------
+    directory: str
+        Filename of the directory config
+    remote_summary_path: str
+        Path of the summary file on every server. ``{host}`` is replaced by the server, e.g.
+        ``/home/user/{host}_Summary``
+    local_root: str
+        A local directory standing in for the servers (for testing)
+    max_workers: int
+        Maximum number of servers read from at the same time. Defaults to the number of servers, capped at 8
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with LogfileName, Instrument and Position columns
+    """
+    hosts = list(generate_directory_config_dict(directory))
+    log.info(f'Collecting summary files from {len(hosts)} servers')
+    if not hosts:
+        return concat_summary_chunks([])
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(len(hosts), 8)) as executor:
+        chunks = list(executor.map(
+            lambda host: read_remote_summary_chunk(host, remote_summary_path.format(host=host), local_root), hosts))
+    return concat_summary_chunks(chunks)
+
+
+def get_consolidated_positions(names, summary_df):
+    """
+    Recon positions for many names in one vectorized pass. Every unique log file (and not every row) is matched
+    to the most specific name it contains, as the folders are (see ``get_most_specific_name``), so a log file
+    counts towards exactly one name. The Name -> LogfileName mapping is joined with the summary and grouped by
+    (Name, Instrument).
+    Parameters
+    ----------
+    names: list
+        Names to recon. on
+    summary_df: pd.DataFrame
+        The dataframe containing the data, indexed by (LogfileName, Instrument)
+
+    Returns
+    -------
+    dict
+        A dictionary of name to a dictionary of instrument to consolidated position
+    """
+    log.info(f"Generating Consolidated positions for {len(names)} name(s)")
+    logfiles = summary_df.index.get_level_values('LogfileName').unique()
+    name_to_logfile = pd.DataFrame({'Name': [get_most_specific_name(logfile, names) for logfile in logfiles],
+                                    'LogfileName': logfiles}).dropna(subset=['Name'])
+
+    positions = name_to_logfile.merge(summary_df.reset_index(), on='LogfileName') \
+        .groupby(['Name', 'Instrument'], sort=False)['Position'].sum()
+
+    position_containers = {name: {} for name in names}
+    for name, name_positions in positions.groupby(level='Name', sort=False):
+        position_containers[name] = name_positions.droplevel('Name').to_dict()
+    return position_containers
 
 
 def get_consolidated_position_on_log_files(name, summary_df, position_container):
@@ -183,24 +803,79 @@ def get_consolidated_position_on_log_files(name, summary_df, position_container)
     -------
     None
     """
-    log.info("Generating Consolidated positions dictionary")
-    for index, row in summary_df.iterrows():
-        if name.lower() in index[0].lower():
-            if position_container.get(index[1]) is not None:
-                position_container[index[1]] = position_container[index[1]] + row['Position']
-            else:
-                position_container[index[1]] = row['Position']
+    position_container.update(get_consolidated_positions([name], summary_df)[name])
+
+
+def read_position_limits(configuration):
+    """
+    Parse the position limits file once into an Instrument x LimitType table. The order of the lines is kept as
+    (row, column) positions into the table, so that the file can be written back in its original order.
+    Parameters
+    ----------
+    configuration: str
+        The configuration file, with lines formatted as ``<instrument>_<LIMITTYPE> = <value>``
+
+    Returns
+    -------
+    dict
+        The ``limits`` table, the ``rows`` and ``columns`` of every line in the table, and the ``keys`` of the lines
+    """
+    lines = pd.read_csv(configuration, sep='=', header=None, names=['Key', 'Value'], engine='c',
+                        dtype={'Key': str, 'Value': 'float64'})
+    keys = lines['Key'].str.strip()
+    key_breakdown = keys.str.rsplit('_', n=1, expand=True)
+    rows, instruments = pd.factorize(key_breakdown[0])
+    columns, limit_types = pd.factorize(key_breakdown[1])
+
+    limits = np.full((len(instruments), len(limit_types)), np.nan)
+    limits[rows, columns] = lines['Value'].to_numpy()
+    return {
+        'limits': pd.DataFrame(limits, index=pd.Index(instruments, name='Instrument'),
+                               columns=pd.Index(limit_types, name='LimitType')),
+        'rows': rows,
+        'columns': columns,
+        'keys': keys.to_numpy(),
+    }
+
+
+def adjust_position_limits(position_limits, position_container):
+    """
+    Adjust the limits of all instruments by their consolidated position in one vectorized join. A position of 200
+    lowers the MAXLONG* limits by 200 and raises the MAXSHORT* limits by 200. Instruments without any position keep
+    their limits.
+    Parameters
+    ----------
+    position_limits: dict
+        The parsed position limits, see ``read_position_limits``
+    position_container: dict
+        The dictionary containing consolidated positions
+
+    Returns
+    -------
+    pd.DataFrame
+        The adjusted Instrument x LimitType table
+    """
+    limits = position_limits['limits']
+    positions = pd.Series(position_container, dtype='float64').reindex(limits.index, fill_value=0).to_numpy()
+    limit_types = limits.columns.str.upper()
+    signs = np.select([limit_types.str.startswith('MAXLONG'), limit_types.str.startswith('MAXSHORT')], [-1, 1], 0)
+    return limits + positions[:, np.newaxis] * signs[np.newaxis, :]
 
 
-def generate_cfg_file(position_container, configuration):
+def generate_cfg_file(position_container, configuration, output_file=None, position_limits=None):
     """
-    Generate a temporary cfg file that needs to be SFTP'ed to the servers
+    Generate a temporary cfg file that needs to be SFTP'ed to the servers. Instruments without any position for the
+    name keep the limits of the start file.
     Parameters
     ----------
     position_container: dict
         The dictionary containing consolidated positions
     configuration:
         The configuration file that needs to be modified
+    output_file: str
+        Where to write the new file. Defaults to PositionLimits.cfg in the temp directory
+    position_limits: dict
+        The already parsed configuration file, see ``read_position_limits``. It is parsed here if None
 
     Returns
     -------
@@ -208,28 +883,50 @@ def generate_cfg_file(position_container, configuration):
         A string containing the file path to the new file
     """
     log.info("Generating Positions config file")
-    tempdir = tempfile.gettempdir()
-    with open(configuration, 'r') as config_file:
-        config_file_container = config_file.readlines()
+    if output_file is None:
+        output_file = os.path.join(tempfile.gettempdir(), 'PositionLimits.cfg')
+    if position_limits is None:
+        position_limits = read_position_limits(configuration)
+
+    adjusted_limits = adjust_position_limits(position_limits, position_container).to_numpy()
+    values = adjusted_limits[position_limits['rows'], position_limits['columns']].astype(np.int64)
+    lines = pd.Series(position_limits['keys']) + ' = ' + pd.Series(values).astype(str)
 
-    with open(os.path.join(tempdir, 'PositionLimits.cfg'), 'w') as position_file:
-        line_container = []
-        for line in config_file_container:
-            line_breakdown = line.split('_')
-            instrument = '_'.join(line_breakdown[:4])
-            value = float(line_breakdown[-1].split(' = ')[-1])
-            type_of_pos = line_breakdown[-1].split(' = ')[0]
+    with open(output_file, 'w') as position_file:
+        position_file.write(''.join(lines + '\n'))
 
-            if type_of_pos.lower() == 'maxlongpos' or type_of_pos.lower() == 'maxlongexposure':
-                value = value - position_container[instrument]
-            elif type_of_pos.lower() == 'maxshortpos' or type_of_pos.lower() == 'maxshortexposure':
-                value = value + position_container[instrument]
+    return output_file
 
-            line_container.append(f'{instrument}_{type_of_pos} = {int(value)}\n')
 
-        position_file.writelines(line_container)
+def generate_cfg_files(position_containers, configuration, position_limits=None):
+    """
+    Generate a cfg file for every name. A single name keeps the PositionLimits.cfg in the temp directory, while
+    many names get a PositionLimits_<name>.cfg each in a fresh temp directory. The configuration file is parsed
+    once for all the names.
+    Parameters
+    ----------
+    position_containers: dict
+        The dictionary of name to consolidated positions
+    configuration:
+        The configuration file that needs to be modified
+    position_limits: dict
+        The already parsed configuration file, see ``read_position_limits``. It is parsed here if None
+
+    Returns
+    -------
+    dict
+        A dictionary of name to the file path of its new file
+    """
+    if position_limits is None:
+        position_limits = read_position_limits(configuration)
+    if len(position_containers) == 1:
+        return {name: generate_cfg_file(position_container, configuration, position_limits=position_limits)
+                for name, position_container in position_containers.items()}
 
-    return os.path.join(tempdir, 'PositionLimits.cfg')
+    output_dir = tempfile.mkdtemp(prefix='position_limits_')
+    return {name: generate_cfg_file(position_container, configuration,
+                                    os.path.join(output_dir, f'PositionLimits_{name}.cfg'), position_limits)
+            for name, position_container in position_containers.items()}
 
 
 def generate_directory_config_dict(directory):
@@ -261,6 +958,52 @@ def generate_directory_config_dict(directory):
     return config_dict
 
 
+def derive_names_from_directory(config_dictionary):
+    """
+    Derive the names to reconcile from the folders in the directory file. The name is the folder name without
+    the ``_Part<N>`` suffix, hence ``/home/user/GFD/`` and ``/home/user/GFD_Part2/`` both give ``GFD``.
+    Parameters
+    ----------
+    config_dictionary: dict
+        The directory config dictionary of server to folders
+
+    Returns
+    -------
+    list
+        The unique names, in the order they appear in the directory file
+    """
+    names = []
+    for folders in config_dictionary.values():
+        for folder in folders:
+            name = re.sub(r'_Part\d+$', '', os.path.basename(folder.strip().rstrip('/')), flags=re.IGNORECASE)
+            if name and name not in names:
+                names.append(name)
+    return names
+
+
+def get_most_specific_name(folder, names):
+    """
+    Get the name a folder belongs to. A folder can contain more than one name as a substring (``NEWFUTURES``
+    contains both ``FUTURES`` and ``NEWFUTURES``), in which case the longest, that is the most specific, name wins
+    so that a folder never receives two different config files.
+    Parameters
+    ----------
+    folder: str
+        The folder on the server
+    names: list
+        The names being reconciled
+
+    Returns
+    -------
+    str
+        The matching name, or None if no name matches
+    """
+    matching_names = [name for name in names if name.lower() in folder.lower()]
+    if not matching_names:
+        return None
+    return max(matching_names, key=len)
+
+
 def sftp_exists(sftp, path):
     try:
         sftp.stat(path)
@@ -269,68 +1012,852 @@ def sftp_exists(sftp, path):
         return False
 
 
-def transfer_file_to_server(directory, position_config_file, name):
+def get_transfer_targets(config_dictionary, position_config_files, names):
     """
-    Transfer the file over to the remote server
+    Group the folders that need a new cfg file by the server they are on
     Parameters
     ----------
-    directory: str
-        Filename of the directory config
-    position_config_file:
-        Position Configuration file
-    name:
-        Name of the logfile
+    config_dictionary: dict
+        The directory config dictionary of server to folders
+    position_config_files: dict
+        The dictionary of name to the file path of its new cfg file
+    names: list
+        All the names reconciled in this run. Folders that match a more specific name are left to that name
 
     Returns
     -------
-    None
+    dict
+        A dictionary of server to a list of (local cfg file, remote folder) tuples
     """
-    config_dictionary = generate_directory_config_dict(directory)
+    targets = {}
     for key, value in config_dictionary.items():
         for val in value:
-            if name.lower() in val.lower():
-                with pysftp.Connection(key, username='osama', private_key="Problem3\\id_rsa") as sftp:
-                    if not sftp.exists(val.strip()):
-                        raise FileNotFoundError(
-                            f'Source path {val} does not exist. Please enter valid source path')
-                    sftp.put(position_config_file, val.strip('\n') + 'PositionLimits.cfg')
-        # print(items)
+            name = get_most_specific_name(val, names)
+            if name in position_config_files:
+                targets.setdefault(key, []).append((position_config_files[name], val.strip()))
+    return targets
 
 
-def main():
+def init_ssh_credentials(ssh_config=None):
     """
-    The main function of the program containing the business logic
+    Set the credentials used to connect to the servers: the ``osama`` user with the ``Problem3\\id_rsa`` key, and
+    only the hosts in the known hosts are accepted, unless the SSH config file says otherwise
+    Parameters
+    ----------
+    ssh_config: str
+        Path of the JSON file with the credentials of the servers and the known hosts, see ``common.transport``
+
     Returns
     -------
-    int: Returns 0 if program runs successfully, or returns 1
+    None
     """
-    try:
-        log.info("Starting main() function")
-        # ===== Step 1: Get all the parameters from the console =====
-        args = parse_args()
-        validate_parameters(args)
-        sanitise_args(args)
-
-        summary_df = get_consolidated_summary_df(args.get('summary'))
-        # Group the summary dfs by (LogfileName, Instrument) as the index, and sum up all the positions
-        log.info("Grouping Summary and summing values")
-        summary_df = summary_df.groupby(['LogfileName', 'Instrument']).sum()
+    set_credentials(username='osama', private_key="Problem3\\id_rsa")
+    set_host_key_options(strict_host_keys=True)
+    if ssh_config is not None:
+        load_ssh_config(ssh_config)
 
-        position_container = {}  # This is for summing up all the "instruments" for a particular log file
-        # Iterate through DF and get consolidated positions
-        get_consolidated_position_on_log_files(args.get('name'), summary_df, position_container)
 
-        # Generate the cfg file
-        position_config_file = generate_cfg_file(position_container, args.get('configuration'))
+def connect_to_server(host):
+    """
+    Open an SFTP session to a server, on the SSH connection to the server shared by the whole process
+    Parameters
+    ----------
+    host: str
+        The server to connect to
+
+    Returns
+    -------
+    common.transport.SFTPSession
+        The SFTP connection object
+    """
+    return open_sftp(host)
+
+
+def is_session_active(sftp):
+    """
+    Check if an SFTP session can still be used
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+
+    Returns
+    -------
+    bool
+        True if the channel of the session is open and its SSH transport is active
+    """
+    channel = sftp.sftp_client.get_channel()
+    return channel is not None and not channel.closed and channel.get_transport().is_active()
+
+
+@contextlib.contextmanager
+def server_session(host):
+    """
+    Get an SFTP session to a server. A new connection is opened, and closed at the end, unless the sessions are kept
+    (``server_sessions`` is a dictionary, in daemon mode), in which case the open session of the server is reused and
+    only replaced when it was dropped or failed.
+    Parameters
+    ----------
+    host: str
+        The server to connect to
+
+    Returns
+    -------
+    common.transport.SFTPSession
+        The SFTP connection object
+    """
+    if server_sessions is None:
+        with connect_to_server(host) as sftp:
+            yield sftp
+        return
+
+    sftp = server_sessions.get(host)
+    if sftp is not None and not is_session_active(sftp):
+        log.info(f'The session to {host} was dropped, reconnecting')
+        close_server_session(host)
+        sftp = None
+    if sftp is None:
+        sftp = server_sessions[host] = connect_to_server(host)
+    try:
+        yield sftp
+    except Exception:
+        close_server_session(host)
+        raise
+
+
+def close_server_session(host):
+    """
+    Close the kept session of a server, if any
+    Parameters
+    ----------
+    host: str
+        The server
+
+    Returns
+    -------
+    None
+    """
+    sftp = server_sessions.pop(host, None)
+    if sftp is not None:
+        try:
+            sftp.close()
+        except Exception as error:
+            log.warning(f'Could not close the session to {host}: {error}')
+
+
+def is_remote_file_identical(sftp, remote_path, local_path, digest):
+    """
+    Check if the file on the server has the same content as the local file. The sizes are compared first, so the
+    remote file is only read when they match.
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    remote_path: str
+        Path of the file on the server
+    local_path: str
+        Path of the local file
+    digest: str
+        The content hash of the local file
+
+    Returns
+    -------
+    bool
+        True if the remote file exists and has the same content
+    """
+    try:
+        remote_stat = sftp.stat(remote_path)
+    except FileNotFoundError:
+        return False
+    if remote_stat.st_size != os.path.getsize(local_path):
+        return False
+    with sftp.open(remote_path, 'rb') as remote_file:
+        return hashlib.blake2b(remote_file.read()).hexdigest() == digest
+
+
+def atomic_put(sftp, local_path, remote_path):
+    """
+    Upload a file to a temporary name next to its destination, and rename it over the destination. A process
+    reading the destination sees either the old or the new file, never a half written one. If the upload or the
+    rename fails, the temporary file is removed, so that nothing is left behind in the folder.
+    Parameters
+    ----------
+    sftp: common.transport.SFTPSession
+        The SFTP connection object
+    local_path: str
+        Path of the local file
+    remote_path: str
+        Path of the file on the server
+
+    Returns
+    -------
+    None
+    """
+    temp_path = f'{remote_path}.{os.getpid()}.tmp'
+    try:
+        sftp.put(local_path, temp_path)
+        # A plain SFTP rename fails when the destination exists, the posix-rename extension replaces it atomically.
+        # There is no fallback: removing the destination first would leave the folder without a cfg file for a while
+        try:
+            sftp.sftp_client.posix_rename(temp_path, remote_path)
+        except IOError as error:
+            raise IOError(f'Could not rename {temp_path} over {remote_path} ({error}). Replacing the file atomically '
+                          f'needs the posix-rename@openssh.com extension on the server') from error
+    except Exception:
+        try:
+            sftp.remove(temp_path)
+        except IOError:
+            # The upload failed before the temporary file was created
+            pass
+        raise
+
+
+def transfer_files_to_host(host, targets, publish_record=None):
+    """
+    Transfer the cfg files to all the folders of a single server over one SFTP session. A file is not uploaded if
+    the last push recorded the same content, or if the file on the server already has the same content.
+    Parameters
+    ----------
+    host: str
+        The server to connect to
+    targets: list
+        List of (local cfg file, remote folder) tuples
+    publish_record: dict
+        The content hash of the last push of every ``<host>:<remote path>``, updated with the new pushes
+
+    Returns
+    -------
+    list
+        List of (remote folder, error) tuples, where the error is None if the transfer succeeded (or was skipped)
+    """
+    publish_record = publish_record if publish_record is not None else {}
+    results = []
+    skipped = 0
+    with server_session(host) as sftp:
+        for position_config_file, folder in targets:
+            try:
+                remote_path = folder + 'PositionLimits.cfg'
+                digest = get_file_digest(position_config_file)
+                if publish_record.get(f'{host}:{remote_path}') == digest or \
+                        is_remote_file_identical(sftp, remote_path, position_config_file, digest):
+                    skipped += 1
+                else:
+                    if not sftp.exists(folder):
+                        raise FileNotFoundError(f'Source path {folder} does not exist. Please enter valid source path')
+                    atomic_put(sftp, position_config_file, remote_path)
+                publish_record[f'{host}:{remote_path}'] = digest
+                results.append((folder, None))
+            except Exception as error:
+                results.append((folder, error))
+    if skipped:
+        log.info(f'Skipped {skipped} unchanged position limits on {host}')
+    return results
+
+
+def load_publish_record(publish_record_file):
+    """
+    Load the record of the last pushes
+    Parameters
+    ----------
+    publish_record_file: str
+        Path to the JSON record file
+
+    Returns
+    -------
+    dict
+        The content hash of the last push of every ``<host>:<remote path>``, empty if there is no record yet
+    """
+    if publish_record_file is None or not os.path.isfile(publish_record_file):
+        return {}
+    with open(publish_record_file) as f:
+        return json.load(f)
+
+
+def save_publish_record(publish_record_file, publish_record):
+    """
+    Save the record of the last pushes, through a temporary file and a rename
+    Parameters
+    ----------
+    publish_record_file: str
+        Path to the JSON record file
+    publish_record: dict
+        The content hash of the last push of every ``<host>:<remote path>``
+
+    Returns
+    -------
+    None
+    """
+    temp_file = f'{publish_record_file}.{os.getpid()}.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(publish_record, f, indent=2, sort_keys=True)
+    os.replace(temp_file, publish_record_file)
+
+
+def transfer_files_to_servers(directory, position_config_files, names, max_workers=None,
+                              publish_record_file=None):
+    """
+    Transfer the cfg files over to the remote servers. Every server gets a single SFTP session for all of its
+    folders, and the servers are transferred to concurrently, so the transfer takes about as long as the slowest
+    server. A failing server or folder does not stop the others, the failures are raised together at the end.
+    Parameters
+    ----------
+    directory: str
+        Filename of the directory config
+    position_config_files: dict
+        The dictionary of name to the file path of its new cfg file
+    names: list
+        All the names reconciled in this run
+    max_workers: int
+        Maximum number of servers transferred to at the same time. Defaults to the number of servers, capped at 8
+    publish_record_file: str
+        JSON file recording the content hash of the last push to every folder, so that unchanged files are skipped
+        without reading them back from the servers
+
+    Returns
+    -------
+    dict
+        A dictionary of server to a list of (remote folder, error) tuples
+    """
+    targets = get_transfer_targets(generate_directory_config_dict(directory), position_config_files, names)
+    if not targets:
+        log.info('No folder to transfer the position limits to')
+        return {}
+
+    max_workers = max_workers or min(len(targets), 8)
+    log.info(f'Transferring position limits to {len(targets)} servers with {max_workers} threads')
+    results = {}
+    publish_record = load_publish_record(publish_record_file)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(transfer_files_to_host, host, host_targets, publish_record): host
+                   for host, host_targets in targets.items()}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                results[host] = future.result()
+            except Exception as error:
+                # The server itself could not be reached, every folder on it failed
+                results[host] = [(folder, error) for _, folder in targets[host]]
+    if publish_record_file is not None:
+        save_publish_record(publish_record_file, publish_record)
+
+    failures = [f'{host}:{folder} ({error})' for host, host_results in results.items()
+                for folder, error in host_results if error is not None]
+    log.info(f'Transferred position limits to {sum(len(r) for r in results.values()) - len(failures)} folders')
+    if failures:
+        raise RuntimeError(f'Failed to transfer position limits to {", ".join(failures)}')
+    return results
+
+
+def transfer_file_to_server(directory, position_config_file, name, names=None):
+    """
+    Transfer the file over to the remote server
+    Parameters
+    ----------
+    directory: str
+        Filename of the directory config
+    position_config_file:
+        Position Configuration file
+    name:
+        Name of the logfile
+    names: list
+        All the names reconciled in this run. Folders that match a more specific name are left to that name
+
+    Returns
+    -------
+    None
+    """
+    transfer_files_to_servers(directory, {name: position_config_file}, names or [name])
+
+
+def read_appended_summary_rows(summary_file, offset):
+    """
+    Read the rows appended to a summary file since ``offset``. Only complete lines are consumed, a partially
+    written last line is left for the next read.
+    Parameters
+    ----------
+    summary_file: str
+        Path to the summary file
+    offset: int
+        Byte offset up to which the file has already been read
+
+    Returns
+    -------
+    tuple
+        The DataFrame of the appended rows (None if there are none) and the new byte offset
+    """
+    with open(summary_file, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    end_of_last_line = data.rfind(b'\n') + 1
+    data = data[:end_of_last_line]
+    if not data.strip():
+        return None, offset + end_of_last_line
+    return read_summary_file(io.BytesIO(data)), offset + end_of_last_line
+
+
+def get_file_id(stat_result):
+    return stat_result.st_dev, stat_result.st_ino
+
+
+def init_follow_state(summary_files):
+    """
+    Initialise the state of the follow mode
+    Parameters
+    ----------
+    summary_files: list
+        List of summary files to follow
+
+    Returns
+    -------
+    dict
+        The byte offset and the identity (device, inode) of every summary file, the (LogfileName, Instrument) ->
+        Position table, and the positions and time of the last push for every name
+    """
+    return {
+        'offsets': {f: 0 for f in summary_files},
+        'file_ids': {f: get_file_id(os.stat(f)) for f in summary_files},
+        'positions': pd.Series(dtype='float64', name='Position',
+                               index=pd.MultiIndex.from_tuples([], names=['LogfileName', 'Instrument'])),
+        'published': {},
+        'last_push': {},
+    }
+
+
+def poll_summary_files(state):
+    """
+    Read the rows appended to every summary file and add them to the in memory position table. If a summary file
+    shrank (it was truncated) or was replaced by another file (it was rotated, the new file can already be longer
+    than the offset read in the old one), every file is read again from the start.
+    Parameters
+    ----------
+    state: dict
+        The follow state, see ``init_follow_state``
+
+    Returns
+    -------
+    bool
+        True if any new row was read
+    """
+    offsets = state['offsets']
+    stat_results = {f: os.stat(f) for f in offsets}
+    if any(stat_results[f].st_size < offset or get_file_id(stat_results[f]) != state['file_ids'][f]
+           for f, offset in offsets.items()):
+        log.warning('A summary file shrank or was replaced, re-reading all summary files from the start')
+        fresh_state = init_follow_state(list(offsets))
+        state['offsets'], state['file_ids'] = fresh_state['offsets'], fresh_state['file_ids']
+        state['positions'] = fresh_state['positions']
+        offsets = state['offsets']
+
+    appended_dfs = []
+    for f, offset in offsets.items():
+        appended_df, offsets[f] = read_appended_summary_rows(f, offset)
+        if appended_df is not None:
+            appended_dfs.append(appended_df)
+
+    if not appended_dfs:
+        return False
+
+    appended_positions = pd.concat(appended_dfs, ignore_index=True) \
+        .groupby(['LogfileName', 'Instrument'])['Position'].sum()
+    state['positions'] = state['positions'].add(appended_positions, fill_value=0)
+    log.info(f'Read {sum(len(df) for df in appended_dfs)} appended summary rows')
+    return True
+
+
+def publish_changed_positions(state, names, configuration, directory, debounce, transfer_workers=None,
+                              publish_record_file=None):
+    """
+    Regenerate and push the cfg file of every name whose net position changed since its last push. A name is
+    pushed at most once every ``debounce`` seconds, the change is picked up by a later call otherwise.
+    Parameters
+    ----------
+    state: dict
+        The follow state, see ``init_follow_state``
+    names: list
+        The names being reconciled
+    configuration: str
+        The configuration file that needs to be modified
+    directory: str
+        Filename of the directory config
+    debounce: float
+        Minimum number of seconds between two pushes of the same name
+    transfer_workers: int
+        Maximum number of servers transferred to at the same time
+    publish_record_file: str
+        JSON file recording the content hash of the last push to every folder
+
+    Returns
+    -------
+    list
+        The names that were pushed
+    """
+    position_containers = get_consolidated_positions(names, state['positions'].to_frame())
+    now = time.monotonic()
+    changed_containers = {
+        name: position_container for name, position_container in position_containers.items()
+        if position_container != state['published'].get(name) and
+        now - state['last_push'].get(name, float('-inf')) >= debounce}
+    if not changed_containers:
+        return []
+
+    transfer_files_to_servers(directory, generate_cfg_files(changed_containers, configuration), names,
+                              transfer_workers, publish_record_file)
+    for name, position_container in changed_containers.items():
+        state['published'][name] = position_container
+        state['last_push'][name] = now
+    log.info(f'Pushed position limits for {", ".join(changed_containers)}')
+    return list(changed_containers)
+
+
+def follow_summary_files(args):
+    """
+    Long running mode that follows the summary files as they grow, and pushes new position limits whenever the
+    net position of a name changes. Runs until interrupted.
+    Parameters
+    ----------
+    args: dict
+        The arguments that the entire script runs on
+
+    Returns
+    -------
+    None
+    """
+    log.info(f'Following {len(args.get("summary"))} summary files')
+    state = init_follow_state(args.get('summary'))
+    try:
+        while True:
+            with profile_stage('poll_summary'):
+                poll_summary_files(state)
+            try:
+                with profile_stage('publish'):
+                    publish_changed_positions(state, args.get('names'), args.get('configuration'),
+                                              args.get('directory'), args.get('debounce'),
+                                              args.get('transfer_workers'), args.get('publish_record'))
+            except Exception as error:
+                # A server that cannot be reached must not stop the pushes for good. The names that failed keep
+                # their last published positions, so the next poll pushes them again
+                log.exception(f'Failed to publish the position limits, retrying on the next poll: {error}')
+            time.sleep(args.get('poll_interval'))
+    except KeyboardInterrupt:
+        log.info('Stopped following summary files')
+
+
+def reconcile(args, summary_df=None, position_limits=None):
+    """
+    Reconcile the positions of the names, generate their cfg files and transfer them to the servers
+    Parameters
+    ----------
+    args: dict
+        The (sanitised) arguments that the reconciliation runs on
+    summary_df: pd.DataFrame
+        The already read summary, with LogfileName, Instrument and Position columns. It is read here if None
+    position_limits: dict
+        The already parsed configuration file, see ``read_position_limits``. It is parsed here if None
+
+    Returns
+    -------
+    dict
+        A dictionary of name to the file path of its new cfg file
+    """
+    if summary_df is None:
+        with profile_stage('summary'):
+            if args.get('remote_summary') is not None:
+                summary_df = collect_remote_summaries(args.get('directory'), args.get('remote_summary'),
+                                                      args.get('summary_source_dir'), args.get('transfer_workers'))
+            else:
+                summary_df = get_consolidated_summary_df(args.get('summary'), args.get('workers'),
+                                                         args.get('cache_dir'), args.get('chunk_size'))
+                if args.get('cache_dir') is not None:
+                    evict_summary_cache(args.get('cache_dir'), args.get('cache_max_size'),
+                                        args.get('cache_max_age'))
+    # Group the summary dfs by (LogfileName, Instrument) as the index, and sum up all the positions
+    log.info("Grouping Summary and summing values")
+    with profile_stage('groupby'):
+        summary_df = summary_df.groupby(['LogfileName', 'Instrument']).sum()
+
+    # Sum up all the "instruments" for the log files of every name in one pass
+    names = args.get('names')
+    with profile_stage('positions'):
+        position_containers = get_consolidated_positions(names, summary_df)
+
+    with profile_stage('generate_cfg'):
+        position_config_files = generate_cfg_files(position_containers, args.get('configuration'), position_limits)
+
+    #  SFTP/SCP the files onto the servers
+    with profile_stage('transfer'):
+        transfer_files_to_servers(args.get('directory'), position_config_files, names,
+                                  args.get('transfer_workers'), args.get('publish_record'))
+    return position_config_files
+
+
+def get_file_stamp(file_path):
+    """
+    Get the size and modification time of a file, which change whenever the file is written to
+    Parameters
+    ----------
+    file_path: str
+        Path to the file
+
+    Returns
+    -------
+    tuple
+        The size and the modification time (in ns) of the file
+    """
+    stat_result = os.stat(file_path)
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+def init_daemon_state(args):
+    """
+    Initialise the state the daemon keeps warm between jobs
+    Parameters
+    ----------
+    args: dict
+        The arguments the daemon was started with, before sanitising. Every job starts from them
+
+    Returns
+    -------
+    dict
+        The daemon ``args``, the parsed ``position_limits`` (with the ``stamp`` of the configuration file they
+        were parsed from), the parsed ``summaries`` (file -> stamp and chunk) and the number of ``jobs`` run
+    """
+    return {'args': dict(args), 'position_limits': None, 'summaries': {}, 'jobs': 0}
+
+
+def get_daemon_position_limits(state, configuration):
+    """
+    Get the parsed configuration file, parsed again only if the file changed since the last job
+    Parameters
+    ----------
+    state: dict
+        The daemon state, see ``init_daemon_state``
+    configuration: str
+        The configuration file
+
+    Returns
+    -------
+    dict
+        The parsed configuration file, see ``read_position_limits``
+    """
+    stamp = (configuration, get_file_stamp(configuration))
+    if state['position_limits'] is None or state['position_limits']['stamp'] != stamp:
+        log.info(f'Parsing the position limits in {configuration}')
+        state['position_limits'] = {'stamp': stamp, 'limits': read_position_limits(configuration)}
+    return state['position_limits']['limits']
+
+
+def get_daemon_summary_df(state, args):
+    """
+    Get the summary of a job. Only the summary files that are new or changed since the last job are parsed, the
+    others are taken from memory. Summary files not used by the job are dropped from memory.
+    Parameters
+    ----------
+    state: dict
+        The daemon state, see ``init_daemon_state``
+    args: dict
+        The (sanitised) arguments of the job
+
+    Returns
+    -------
+    pd.DataFrame
+        A DataFrame with LogfileName, Instrument and Position columns
+    """
+    summaries = state['summaries']
+    stamps = {f: get_file_stamp(f) for f in args.get('summary')}
+    stale_files = [f for f, stamp in stamps.items() if f not in summaries or summaries[f]['stamp'] != stamp]
+    if stale_files:
+        chunks = read_summary_chunks(stale_files, args.get('workers'), args.get('cache_dir'), args.get('chunk_size'))
+        summaries.update({f: {'stamp': stamps[f], 'chunk': chunk} for f, chunk in zip(stale_files, chunks)})
+    for f in [f for f in summaries if f not in stamps]:
+        del summaries[f]
+    log.info(f'Parsed {len(stale_files)} summary files, {len(stamps) - len(stale_files)} were unchanged')
+    return concat_summary_chunks([summaries[f]['chunk'] for f in args.get('summary')])
+
+
+def run_daemon_job(state, job):
+    """
+    Run a reconciliation job sent to the daemon. The job is validated like the arguments of the script, starting
+    from the arguments the daemon was started with.
+    Parameters
+    ----------
+    state: dict
+        The daemon state, see ``init_daemon_state``
+    job: dict
+        The job, with the ``name`` (a name, a comma separated string or a list of names) or ``all_names``, and the
+        ``summary`` files (a comma separated string or a list) or the ``remote_summary`` path
+
+    Returns
+    -------
+    dict
+        The ``names`` reconciled, the cfg ``files`` generated for them and the wall time in ``seconds``
+    """
+    start = time.perf_counter()
+    args = dict(state['args'], daemon=False)
+    for key in ['name', 'summary']:
+        if isinstance(job.get(key), list):
+            job = dict(job, **{key: ','.join(job[key])})
+    for key in ['name', 'all_names', 'summary', 'remote_summary']:
+        if key in job:
+            args[key] = job[key]
+    validate_parameters(args)
+    sanitise_args(args)
+
+    state['jobs'] += 1
+    log.info(f'Running job {state["jobs"]} for {", ".join(args["names"])}')
+    position_limits = get_daemon_position_limits(state, args.get('configuration'))
+    summary_df = None
+    if args.get('remote_summary') is None:
+        with profile_stage('summary'):
+            summary_df = get_daemon_summary_df(state, args)
+    position_config_files = reconcile(args, summary_df, position_limits)
+    return {'names': args['names'], 'files': position_config_files, 'seconds': time.perf_counter() - start}
+
+
+class DaemonRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests sent to the daemon. ``POST /reconcile`` with a JSON job (see ``run_daemon_job``) runs a
+    reconciliation and ``GET /status`` describes what is kept warm. The daemon state is ``self.server.daemon_state``.
+    """
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        state = self.server.daemon_state
+        self.send_json(200, {'jobs': state['jobs'], 'summaries': list(state['summaries']),
+                             'position_limits': state['position_limits'] is not None,
+                             'sessions': list(server_sessions or [])})
+
+    def do_POST(self):
+        if self.path != '/reconcile':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(job, dict):
+                raise ValueError('The job must be a JSON object')
+            self.send_json(200, run_daemon_job(self.server.daemon_state, job))
+        except (ValueError, FileNotFoundError) as error:
+            log.warning(f'Rejected job: {error}')
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            log.exception(error)
+            self.send_json(500, {'error': str(error)})
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # The default writes to stderr, and needs an IP address which a Unix socket does not have
+        log.info('Daemon request ' + format, *args)
+
+
+def create_daemon_server(args, state):
+    """
+    Create the server the daemon gets its jobs from: on the Unix socket ``args['socket']`` if given, else on
+    ``args['port']`` of 127.0.0.1, so that only local clients can send jobs
+    Parameters
+    ----------
+    args: dict
+        The arguments the daemon was started with
+    state: dict
+        The daemon state, see ``init_daemon_state``
+
+    Returns
+    -------
+    socketserver.BaseServer
+        The server, not serving yet
+    """
+    if args.get('socket') is not None:
+        socket_path = args.get('socket')
+        # A socket left behind by a daemon that did not stop cleanly would make the bind fail
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.remove(socket_path)
+        server = socketserver.UnixStreamServer(socket_path, DaemonRequestHandler)
+    else:
+        server = http.server.HTTPServer(('127.0.0.1', args.get('port')), DaemonRequestHandler)
+    server.daemon_state = state
+    return server
+
+
+def serve_daemon(args, raw_args):
+    """
+    Long running mode that keeps the parsed position limits, the parsed summary files and the SFTP sessions to the
+    servers warm, and runs the jobs sent to it one at a time. Runs until interrupted.
+    Parameters
+    ----------
+    args: dict
+        The (sanitised) arguments the daemon was started with
+    raw_args: dict
+        The same arguments before sanitising, the jobs are sanitised from them
+
+    Returns
+    -------
+    None
+    """
+    global server_sessions
+    server_sessions = {}
+    state = init_daemon_state(raw_args)
+    # Pay for the imports and the parsing now, and not on the first job
+    get_daemon_position_limits(state, args.get('configuration'))
+    if args.get('summary') is not None:
+        get_daemon_summary_df(state, args)
+
+    server = create_daemon_server(args, state)
+    log.info(f'Daemon listening on {args.get("socket") or "127.0.0.1:" + str(server.server_address[1])}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info('Stopped the daemon')
+    finally:
+        server.server_close()
+        for host in list(server_sessions):
+            close_server_session(host)
+        server_sessions = None
+        if args.get('socket') is not None and os.path.exists(args.get('socket')):
+            os.remove(args.get('socket'))
+
+
+def main():
+    """
+    The main function of the program containing the business logic
+    Returns
+    -------
+    int: Returns 0 if program runs successfully, or returns 1
+    """
+    try:
+        log.info("Starting main() function")
+        # ===== Step 1: Get all the parameters from the console =====
+        args = parse_args()
+        validate_parameters(args)
+        raw_args = dict(args)
+        sanitise_args(args)
+        init_ssh_credentials(args.get('ssh_config'))
+        if args.get('profile') or args.get('profile_dir') is not None:
+            init_profiler(args.get('profile_dir'))
 
-        #  SFTP/SCP the file onto the server
-        transfer_file_to_server(args.get('directory'), position_config_file, args.get('name'))
+        if args.get('follow'):
+            follow_summary_files(args)
+        elif args.get('daemon'):
+            serve_daemon(args, raw_args)
+        else:
+            reconcile(args)
+        return 0
 
     except Exception as error:
         log.exception(error)
+        return 1
 
     finally:
-        logging.shutdown()
+        if profile_stages is not None:
+            report_profile()
+        shutdown_logging()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,415 @@
+import unittest
+import os
+import glob
+import io
+import json
+import pstats
+import tempfile
+import shutil
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+from unittest import mock
+import main
+import generate_data
+import benchmark
+import pandas as pd
+
+PROBLEM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Problem3')
+
+
+class TestPositionReconciliation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.summary_files = sorted(glob.glob(os.path.join(PROBLEM_DIR, '*_Summary')))
+        cls.configuration = os.path.join(PROBLEM_DIR, 'PositionLimits_Start.cfg')
+        cls.directory = os.path.join(PROBLEM_DIR, 'directory')
+        main.log = main.init_logger()
+
+    def test_read_summary_file_matches_python_engine(self):
+        for f in self.summary_files:
+            expected = pd.read_csv(f, header=None, sep=r'\s+', on_bad_lines=lambda line: line[:11],
+                                   engine='python')[[0, 1, 3]].astype({3: float})
+            expected.columns = main.SUMMARY_COLUMN_NAMES
+            pd.testing.assert_frame_equal(main.read_summary_file(f), expected)
+
+    def test_consolidated_summary(self):
+        summary_df = main.get_consolidated_summary_df(self.summary_files)
+        self.assertEqual(len(summary_df), 54)
+        self.assertEqual(summary_df['Position'].dtype, 'float64')
+        # The ragged "unhedged" line is kept and parsed like every other line
+        ragged = summary_df[(summary_df['LogfileName'] == 'out_GFD_Part2') &
+                            (summary_df['Instrument'] == 'NSE_FO_MQG_1703')]
+        self.assertEqual(ragged['Position'].tolist(), [8800.0])
+
+    def test_consolidated_summary_with_workers(self):
+        expected = main.get_consolidated_summary_df(self.summary_files, workers=1)
+        pd.testing.assert_frame_equal(main.get_consolidated_summary_df(self.summary_files, workers=3), expected)
+
+    def test_consolidated_summary_with_cache(self):
+        expected = main.get_consolidated_summary_df(self.summary_files, workers=1)
+        with tempfile.TemporaryDirectory() as tempdir:
+            summary_files = []
+            for f in self.summary_files:
+                summary_files.append(shutil.copy(f, tempdir))
+            cache_dir = os.path.join(tempdir, 'cache')
+            pd.testing.assert_frame_equal(main.get_consolidated_summary_df(summary_files, 1, cache_dir), expected)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+            with mock.patch.object(main, 'read_summary_file', wraps=main.read_summary_file) as read_summary_file:
+                pd.testing.assert_frame_equal(main.get_consolidated_summary_df(summary_files, 1, cache_dir),
+                                              expected)
+                self.assertEqual(read_summary_file.call_count, 0)
+
+                # Only the changed summary file is parsed again
+                with open(summary_files[0], 'a') as f:
+                    f.write('outfile_NEW NSE_FO_BHP_1703 0 100\n')
+                summary_df = main.get_consolidated_summary_df(summary_files, 1, cache_dir)
+                self.assertEqual(read_summary_file.call_count, 1)
+                self.assertEqual(len(summary_df), len(expected) + 1)
+
+            self.assertEqual(main.evict_summary_cache(cache_dir, max_size=0), 3)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_consolidated_summary_in_chunks(self):
+        summary_df = main.get_consolidated_summary_df(self.summary_files, workers=1)
+        expected = summary_df.groupby(['LogfileName', 'Instrument']).sum()
+        for workers in [1, 3]:
+            aggregated_df = main.get_consolidated_summary_df(self.summary_files, workers, chunk_size=4)
+            self.assertEqual(aggregated_df['Position'].dtype, 'float64')
+            pd.testing.assert_frame_equal(aggregated_df.groupby(['LogfileName', 'Instrument']).sum(), expected)
+
+    def test_collect_remote_summaries(self):
+        expected = main.get_consolidated_summary_df(self.summary_files, workers=1)
+        summary_df = main.collect_remote_summaries(self.directory, '/{host}_Summary', PROBLEM_DIR)
+        pd.testing.assert_frame_equal(summary_df, expected)
+
+    def test_consolidated_position(self):
+        summary_df = main.get_consolidated_summary_df(self.summary_files)
+        summary_df = summary_df.groupby(['LogfileName', 'Instrument']).sum()
+        position_container = {}
+        main.get_consolidated_position_on_log_files('GFD', summary_df, position_container)
+        self.assertEqual(position_container['NSE_FO_BHP_1703'], -13200.0)
+
+    def test_consolidated_positions_for_many_names(self):
+        summary_df = main.get_consolidated_summary_df(self.summary_files)
+        summary_df = summary_df.groupby(['LogfileName', 'Instrument']).sum()
+        names = ['GFD', 'LIMIT', 'INDEX', 'NEWSTRAT']
+        position_containers = main.get_consolidated_positions(names, summary_df)
+        for name in names:
+            expected = {}
+            for index, row in summary_df.iterrows():
+                if name.lower() in index[0].lower():
+                    expected[index[1]] = expected.get(index[1], 0) + row['Position']
+            self.assertEqual(position_containers[name], expected)
+
+    def test_consolidated_positions_for_overlapping_names(self):
+        summary_df = pd.DataFrame({'Position': [10.0, 1.0, 100.0]}, index=pd.MultiIndex.from_tuples(
+            [('FUTURES_1.log', 'A'), ('NEWFUTURES_1.log', 'A'), ('NEWFUTURES_2.log', 'B')],
+            names=['LogfileName', 'Instrument']))
+        # The NEWFUTURES log files belong to NEWFUTURES only, as its folders do
+        self.assertEqual(main.get_consolidated_positions(['FUTURES', 'NEWFUTURES'], summary_df),
+                         {'FUTURES': {'A': 10.0}, 'NEWFUTURES': {'A': 1.0, 'B': 100.0}})
+        self.assertEqual(main.get_consolidated_positions(['FUTURES'], summary_df),
+                         {'FUTURES': {'A': 11.0, 'B': 100.0}})
+
+    def test_derive_names_from_directory(self):
+        names = main.derive_names_from_directory(main.generate_directory_config_dict(self.directory))
+        self.assertEqual(names, ['LIMIT', 'FUTURES', 'NEWFUTURES', 'GFD', 'INDEX', 'NEWSTRAT'])
+        self.assertEqual(main.get_most_specific_name('/home/user/NEWFUTURES/', names), 'NEWFUTURES')
+        self.assertEqual(main.get_most_specific_name('/home/user/FUTURES_Part1/', names), 'FUTURES')
+        self.assertIsNone(main.get_most_specific_name('/home/user/OTHER/', names))
+
+    def test_generate_cfg_file(self):
+        position_container = {'NSE_FO_BHP_1703': -13200.0}
+        with tempfile.TemporaryDirectory() as tempdir:
+            output_file = main.generate_cfg_file(position_container, self.configuration,
+                                                 os.path.join(tempdir, 'PositionLimits.cfg'))
+            with open(output_file) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines[:5], ['NSE_FO_BHP_1703_MAXLONGPOS = 213200',
+                                     'NSE_FO_BHP_1703_MAXSHORTPOS = 186800',
+                                     'NSE_FO_BHP_1703_MAXLONGEXPOSURE = 263200',
+                                     'NSE_FO_BHP_1703_MAXSHORTEXPOSURE = 236800',
+                                     'NSE_FO_BHP_1704_MAXLONGPOS = 200000'])
+
+    def test_generate_cfg_file_matches_line_by_line(self):
+        summary_df = main.get_consolidated_summary_df(self.summary_files)
+        summary_df = summary_df.groupby(['LogfileName', 'Instrument']).sum()
+        position_container = main.get_consolidated_positions(['GFD'], summary_df)['GFD']
+        expected = []
+        with open(self.configuration) as f:
+            for line in f:
+                key, value = line.strip().split(' = ')
+                instrument, type_of_pos = key.rsplit('_', 1)
+                if type_of_pos.startswith('MAXLONG'):
+                    expected.append(f'{key} = {int(float(value) - position_container[instrument])}')
+                else:
+                    expected.append(f'{key} = {int(float(value) + position_container[instrument])}')
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            output_file = main.generate_cfg_file(position_container, self.configuration,
+                                                 os.path.join(tempdir, 'PositionLimits.cfg'))
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), expected)
+
+    def test_read_position_limits(self):
+        position_limits = main.read_position_limits(self.configuration)
+        self.assertEqual(position_limits['limits'].shape, (6, 4))
+        self.assertEqual(position_limits['limits'].loc['NSE_FO_MQG_1704', 'MAXSHORTEXPOSURE'], 400000)
+        adjusted = main.adjust_position_limits(position_limits, {'NSE_FO_MQG_1704': 200.0, 'NSE_CM_MQG': 1.0})
+        self.assertEqual(adjusted.loc['NSE_FO_MQG_1704'].tolist(), [299800, 300200, 399800, 400200])
+        self.assertEqual(adjusted.loc['NSE_FO_MQG_1703'].tolist(), [300000, 300000, 400000, 400000])
+
+    def test_follow_summary_files(self):
+        summary_df = main.get_consolidated_summary_df(self.summary_files)
+        expected = summary_df.groupby(['LogfileName', 'Instrument'])['Position'].sum()
+        with tempfile.TemporaryDirectory() as tempdir:
+            followed_files = [os.path.join(tempdir, os.path.basename(f)) for f in self.summary_files]
+            contents = []
+            for f, followed_file in zip(self.summary_files, followed_files):
+                with open(f, 'rb') as source:
+                    contents.append(source.read())
+                with open(followed_file, 'wb') as target:
+                    # Write the first half, cutting the last line in the middle
+                    target.write(contents[-1][:len(contents[-1]) // 2])
+
+            state = main.init_follow_state(followed_files)
+            with mock.patch.object(main, 'transfer_files_to_servers') as transfer:
+                self.assertTrue(main.poll_summary_files(state))
+                self.assertEqual(main.publish_changed_positions(state, ['GFD'], self.configuration,
+                                                                self.directory, debounce=0), ['GFD'])
+                self.assertFalse(main.poll_summary_files(state))
+                self.assertEqual(main.publish_changed_positions(state, ['GFD'], self.configuration,
+                                                                self.directory, debounce=0), [])
+
+                for followed_file, content in zip(followed_files, contents):
+                    with open(followed_file, 'ab') as target:
+                        target.write(content[len(content) // 2:])
+                self.assertTrue(main.poll_summary_files(state))
+                # A push happened just now, the debounce holds the change back
+                self.assertEqual(main.publish_changed_positions(state, ['GFD'], self.configuration,
+                                                                self.directory, debounce=3600), [])
+                self.assertEqual(main.publish_changed_positions(state, ['GFD'], self.configuration,
+                                                                self.directory, debounce=0), ['GFD'])
+                self.assertEqual(transfer.call_count, 2)
+
+            pd.testing.assert_series_equal(state['positions'].sort_index(), expected.sort_index(),
+                                           check_names=False)
+            self.assertEqual(state['published']['GFD']['NSE_FO_BHP_1703'], -13200.0)
+
+            # A rotated file, already longer than the offset read in the old one, is read again from the start
+            header, *rows = contents[0].splitlines(keepends=True)
+            rotated_content = header + rows[-1] * (len(contents[0]) // len(rows[-1]) + 1)
+            rotated_file = followed_files[0] + '.new'
+            with open(rotated_file, 'wb') as target:
+                target.write(rotated_content)
+            os.replace(rotated_file, followed_files[0])
+            self.assertTrue(main.poll_summary_files(state))
+            self.assertEqual(state['offsets'][followed_files[0]], len(rotated_content))
+            expected = main.get_consolidated_summary_df(followed_files) \
+                .groupby(['LogfileName', 'Instrument'])['Position'].sum()
+            pd.testing.assert_series_equal(state['positions'].sort_index(), expected.sort_index(), check_names=False)
+
+    def test_follow_retries_failed_publish(self):
+        states = []
+        sleeps = []
+        init_follow_state = main.init_follow_state
+
+        def follow_state(summary_files):
+            states.append(init_follow_state(summary_files))
+            return states[-1]
+
+        def sleep(seconds):
+            if len(sleeps) == 0:
+                # The failed push is not recorded, so the next poll retries it
+                self.assertEqual(states[0]['published'], {})
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                raise KeyboardInterrupt
+
+        args = {'summary': self.summary_files, 'names': ['GFD'], 'configuration': self.configuration,
+                'directory': self.directory, 'debounce': 0, 'poll_interval': 0}
+        with mock.patch.object(main, 'init_follow_state', side_effect=follow_state), \
+                mock.patch.object(main, 'transfer_files_to_servers',
+                                  side_effect=[RuntimeError('Failed to transfer position limits'), {}]) as transfer, \
+                mock.patch.object(main.time, 'sleep', side_effect=sleep):
+            main.follow_summary_files(args)
+        self.assertEqual(transfer.call_count, 2)
+        self.assertEqual(states[0]['published']['GFD']['NSE_FO_BHP_1703'], -13200.0)
+
+    def test_transfer_files_to_servers(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            position_config_files = {}
+            for name in ['GFD', 'LIMIT']:
+                position_config_files[name] = os.path.join(tempdir, f'{name}.cfg')
+                with open(position_config_files[name], 'w') as f:
+                    f.write(f'{name}_MAXLONGPOS = 1\n')
+            for folder in ['20.30.40.51/home/user/LIMIT_Part2', '20.30.40.51/home/user/GFD',
+                           '20.30.40.52/home/user/LIMIT_Part3', '20.30.40.52/home/user/GFD_Part2']:
+                os.makedirs(os.path.join(tempdir, folder))
+            connections = []
+
+            def connection(host):
+                if host == '20.30.40.50':
+                    raise ConnectionError('unreachable')
+                connections.append(benchmark.LocalSFTPConnection(os.path.join(tempdir, host)))
+                return connections[-1]
+
+            with mock.patch.object(main, 'connect_to_server', side_effect=connection):
+                with self.assertRaises(RuntimeError) as raised:
+                    main.transfer_files_to_servers(self.directory, position_config_files, ['GFD', 'LIMIT'], 2)
+                self.assertIn('20.30.40.50:/home/user/LIMIT/', str(raised.exception))
+                # One session per reachable server, for all of its folders
+                self.assertEqual(sorted(connection.root for connection in connections),
+                                 [os.path.join(tempdir, '20.30.40.51'), os.path.join(tempdir, '20.30.40.52')])
+                self.assertEqual(sum(connection.uploads for connection in connections), 4)
+                with open(os.path.join(tempdir, '20.30.40.52/home/user/GFD_Part2/PositionLimits.cfg')) as f:
+                    self.assertEqual(f.read(), 'GFD_MAXLONGPOS = 1\n')
+                self.assertEqual(os.listdir(os.path.join(tempdir, '20.30.40.51/home/user/GFD')),
+                                 ['PositionLimits.cfg'])
+
+                # Unchanged files are not uploaded again, changed ones are
+                connections.clear()
+                with open(position_config_files['GFD'], 'w') as f:
+                    f.write('GFD_MAXLONGPOS = 2\n')
+                publish_record_file = os.path.join(tempdir, 'publish_record.json')
+                with self.assertRaises(RuntimeError):
+                    main.transfer_files_to_servers(self.directory, position_config_files, ['GFD', 'LIMIT'], 2,
+                                                   publish_record_file)
+                self.assertEqual(sum(connection.uploads for connection in connections), 2)
+                with open(publish_record_file) as f:
+                    self.assertEqual(len(json.load(f)), 4)
+
+    def test_atomic_put_failure(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            local_path = os.path.join(tempdir, 'PositionLimits.cfg')
+            with open(local_path, 'w') as f:
+                f.write('GFD_MAXLONGPOS = 1\n')
+            os.makedirs(os.path.join(tempdir, 'server', 'GFD'))
+            sftp = benchmark.LocalSFTPConnection(os.path.join(tempdir, 'server'))
+            # A server without the posix-rename extension
+            with mock.patch.object(sftp, 'posix_rename', side_effect=IOError('Operation unsupported')):
+                with self.assertRaises(IOError) as raised:
+                    main.atomic_put(sftp, local_path, '/GFD/PositionLimits.cfg')
+            self.assertIn('posix-rename@openssh.com', str(raised.exception))
+            self.assertEqual(os.listdir(os.path.join(tempdir, 'server', 'GFD')), [])
+
+            with mock.patch.object(sftp, 'put', side_effect=IOError('connection dropped')):
+                with self.assertRaises(IOError):
+                    main.atomic_put(sftp, local_path, '/GFD/PositionLimits.cfg')
+            self.assertEqual(os.listdir(os.path.join(tempdir, 'server', 'GFD')), [])
+
+    def test_profile_stages(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            main.init_profiler(tempdir)
+            try:
+                for _ in range(3):
+                    with main.profile_stage('groupby'):
+                        main.get_consolidated_summary_df(self.summary_files, workers=1).groupby(['LogfileName']).sum()
+                # Nothing is written until the report, whatever the number of calls
+                self.assertEqual(os.listdir(tempdir), [])
+                with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                    report = main.report_profile()
+                self.assertIn('groupby', stdout.getvalue())
+                self.assertEqual(report['stages']['groupby']['calls'], 3)
+                self.assertGreater(report['stages']['groupby']['peak_memory'], 0)
+                self.assertEqual(sorted(os.listdir(tempdir)), ['groupby.pstats', 'profile_report.json'])
+                self.assertGreater(pstats.Stats(os.path.join(tempdir, 'groupby.pstats')).total_calls, 0)
+            finally:
+                main.profile_stages = None
+                main.profile_dir = None
+                main.tracemalloc.stop()
+
+    def test_profile_dir_turns_on_profiling(self):
+        def reconcile(args):
+            with main.profile_stage('groupby'):
+                pass
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            try:
+                with mock.patch.object(main, 'parse_args', return_value={'profile_dir': tempdir}), \
+                        mock.patch.object(main, 'validate_parameters'), mock.patch.object(main, 'sanitise_args'), \
+                        mock.patch.object(main, 'init_ssh_credentials'), \
+                        mock.patch.object(main, 'reconcile', side_effect=reconcile), \
+                        mock.patch.object(main, 'shutdown_logging'), \
+                        mock.patch('sys.stdout', new_callable=io.StringIO):
+                    self.assertEqual(main.main(), 0)
+                self.assertEqual(sorted(os.listdir(tempdir)), ['groupby.pstats', 'profile_report.json'])
+            finally:
+                main.profile_stages = None
+                main.profile_dir = None
+                main.tracemalloc.stop()
+
+    def test_daemon_jobs(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            for folder in ['20.30.40.51/home/user/GFD', '20.30.40.52/home/user/GFD_Part2']:
+                os.makedirs(os.path.join(tempdir, folder))
+            connections = []
+
+            def connection(host):
+                connections.append(benchmark.LocalSFTPConnection(os.path.join(tempdir, host)))
+                return connections[-1]
+
+            args = {'configuration': self.configuration, 'directory': self.directory, 'workers': 1, 'port': 0}
+            state = main.init_daemon_state(args)
+            server = main.create_daemon_server(args, state)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+            try:
+                with mock.patch.object(main, 'connect_to_server', side_effect=connection), \
+                        mock.patch.object(main, 'server_sessions', {}), \
+                        mock.patch.object(main, 'read_summary_file', wraps=main.read_summary_file) as read_summary, \
+                        mock.patch.object(main, 'read_position_limits',
+                                          wraps=main.read_position_limits) as read_limits:
+                    job = json.dumps({'name': ['GFD'], 'summary': self.summary_files}).encode()
+                    for _ in range(2):
+                        with urllib.request.urlopen(url + '/reconcile', data=job) as response:
+                            result = json.load(response)
+                    self.assertEqual(result['names'], ['GFD'])
+                    # The second job parses nothing again, and reuses the sessions to the servers
+                    self.assertEqual(read_summary.call_count, 3)
+                    self.assertEqual(read_limits.call_count, 1)
+                    self.assertEqual(len(connections), 2)
+                    with open(result['files']['GFD']) as expected, \
+                            open(os.path.join(tempdir, '20.30.40.52/home/user/GFD_Part2/PositionLimits.cfg')) as f:
+                        self.assertEqual(f.read(), expected.read())
+
+                    with self.assertRaises(urllib.error.HTTPError) as raised:
+                        urllib.request.urlopen(url + '/reconcile', data=json.dumps({'name': 'GFD'}).encode())
+                    self.assertEqual(raised.exception.code, 400)
+                    with urllib.request.urlopen(url + '/status') as response:
+                        self.assertEqual(json.load(response)['jobs'], 2)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def test_lazy_imports(self):
+        output = subprocess.run([sys.executable, '-c', "import sys, main; print('pandas.core' in sys.modules)"],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        self.assertEqual(output.stdout.strip(), 'False')
+
+    def test_benchmark_on_generated_data(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            data = generate_data.generate_data(tempdir, servers=2, strategies=3, instruments=10, rows=500,
+                                               bad_fraction=0.5)
+            summary_df = main.get_consolidated_summary_df(data['summary'], workers=1)
+            self.assertEqual(len(summary_df), 1000)
+            self.assertEqual(summary_df['Position'].isna().sum(), 0)
+
+            result = benchmark.run_benchmark(data, workers=1)
+            self.assertEqual(result['rows'], 1000)
+            # Every strategy has a folder on every server
+            self.assertEqual(result['uploads'], 6)
+
+            # A run that fails is not reported
+            with mock.patch.object(main, 'reconcile', side_effect=ValueError('bad summary')):
+                with self.assertRaises(RuntimeError):
+                    benchmark.run_benchmark(data, workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Lazy imports of the heavy modules (pandas, numpy, pysftp, ...). Importing them takes most of the start up time of
+a script, which is wasted when the script only prints its ```--help``` or fails the validation of its parameters.
+"""
+
+import sys
+import types
+import importlib
+import importlib.util
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on the first access to one of its attributes. The import goes through
+    the regular import system, whose per module locks make a thread that uses the module while another thread is
+    importing it wait for the import to finish (``importlib.util.LazyLoader`` does not, before Python 3.12).
+    """
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.__name__), attribute)
+
+
+def lazy_import(name):
+    """
+    Import a module lazily: a stand-in is returned straight away, and the module is only imported on the first
+    access to one of its attributes (e.g. ``pd.read_csv``). A module that is already imported is returned as is.
+    Parameters
+    ----------
+    name: str
+        The name of the module, e.g. ``pandas``
+
+    Returns
+    -------
+    module
+        The module, or its stand-in
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    return _LazyModule(name)
+
+
+def load_modules(*modules):
+    """
+    Import the modules behind lazy stand-ins now, e.g. before forking worker processes, which would otherwise each
+    import them again. Modules that are already imported are left as they are.
+    Parameters
+    ----------
+    modules: module
+        The modules, or their stand-ins (see ``lazy_import``)
+
+    Returns
+    -------
+    None
+    """
+    for module in modules:
+        importlib.import_module(module.__name__)
@@ -0,0 +1,179 @@
+"""
+Logging shared by all the tools of this repository.
+
+Every tool used to attach a console and a file handler straight to its logger, so every log call wrote the record
+to the console and the disk on the calling thread. Here the logger only gets a ```QueueHandler```: the calling
+thread merges the message with its arguments (so that an argument changed after the call is logged as it was) and
+puts the record on a queue, and a ```QueueListener``` thread writes it to the console and the log file.
+```shutdown_logging()``` flushes the queue before the script exits.
+
+Messages logged once per item (per file, per print, ...) go to an item logger (```get_item_logger```), a child
+of the tool logger with its own level, which can also keep only every n-th message and / or at most a number of
+messages per second. The levels and the limits can be overridden with environment variables, with the logger
+name in upper case and ```.``` replaced by ```_```, e.g. for the ```downloader_framework.items``` logger:
+```LOG_LEVEL_DOWNLOADER_FRAMEWORK_ITEMS=WARNING```, ```LOG_SAMPLE_DOWNLOADER_FRAMEWORK_ITEMS=100``` (keep one
+message in 100) and ```LOG_RATE_DOWNLOADER_FRAMEWORK_ITEMS=10``` (at most 10 messages per second).
+"""
+
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+import tempfile
+import datetime
+import threading
+import time
+
+FORMAT = '%(asctime)s - %(name)s - %(filename)s:%(lineno)s - %(funcName)20s() - %(levelname)s - %(message)s'
+
+# The listener (background thread) of every logger initialised with init_logger
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Filter keeping only every ``sample_every``-th record, and at most ``max_per_second`` records per second
+    """
+
+    def __init__(self, sample_every=1, max_per_second=None):
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self.max_per_second = max_per_second
+        self._seen = 0
+        self._window_start = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            self._seen += 1
+            if (self._seen - 1) % self.sample_every:
+                return False
+            if self.max_per_second is not None:
+                now = time.monotonic()
+                if now - self._window_start >= 1:
+                    self._window_start = now
+                    self._window_count = 0
+                if self._window_count >= self.max_per_second:
+                    return False
+                self._window_count += 1
+        return True
+
+
+def _env_name(name):
+    return name.upper().replace('.', '_')
+
+
+def _level_from_env(name, level):
+    return os.environ.get(f'LOG_LEVEL_{_env_name(name)}', level)
+
+
+def init_logger(name, level=logging.DEBUG, console_level=logging.DEBUG, file_level=logging.DEBUG):
+    """
+    Initializes the logger. The console and the log file (in a new temporary folder) are written to by a background
+    thread, the logger itself only puts the records on a queue.
+    Parameters
+    ----------
+    name: str
+        Name of the logger, also used as the prefix of the temporary folder of the log file
+    level: int or str
+        Level of the logger, can be overridden with the ``LOG_LEVEL_<NAME>`` environment variable
+    console_level: int or str
+        Level of the console output
+    file_level: int or str
+        Level of the log file
+
+    Returns
+    -------
+    Logger object
+    """
+    tempdir = tempfile.mkdtemp(prefix=f'{name}_{os.getpid()}__{datetime.datetime.now().strftime("%H_%M_%S")}')
+
+    logger = logging.getLogger(name)
+    logger.setLevel(_level_from_env(name, level))
+    formatter = logging.Formatter(FORMAT)
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(os.path.join(tempdir, 'logfile.log'))
+    fh.setLevel(file_level)
+    fh.setFormatter(formatter)
+    ch = logging.StreamHandler()
+    ch.setLevel(console_level)
+    ch.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, ch, fh, respect_handler_level=True)
+    with _listeners_lock:
+        # Initialising the same logger again replaces its handlers instead of adding more of them
+        if name in _listeners:
+            _stop_listener(name)
+        for handler in [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+            logger.removeHandler(handler)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        listener.start()
+        _listeners[name] = listener
+
+    return logger
+
+
+def get_item_logger(logger, level=logging.INFO, sample_every=1, max_per_second=None):
+    """
+    Get the logger for the messages logged once per item. It is the ``items`` child of ``logger``, so it goes
+    through the same handlers, but has its own level and sampling / rate limits. The limits can be overridden with
+    the ``LOG_SAMPLE_<NAME>`` and ``LOG_RATE_<NAME>`` environment variables.
+    Parameters
+    ----------
+    logger: logging.Logger
+        The logger of the tool
+    level: int or str
+        Level of the item logger, can be overridden with the ``LOG_LEVEL_<NAME>`` environment variable
+    sample_every: int
+        Keep only one message in ``sample_every``
+    max_per_second: float
+        Keep at most this many messages per second. No limit if None
+
+    Returns
+    -------
+    Logger object
+    """
+    item_logger = logger.getChild('items')
+    item_logger.setLevel(_level_from_env(item_logger.name, level))
+    sample_every = int(os.environ.get(f'LOG_SAMPLE_{_env_name(item_logger.name)}', sample_every))
+    max_per_second = os.environ.get(f'LOG_RATE_{_env_name(item_logger.name)}', max_per_second)
+    for log_filter in [f for f in item_logger.filters if isinstance(f, SamplingFilter)]:
+        item_logger.removeFilter(log_filter)
+    if sample_every > 1 or max_per_second is not None:
+        item_logger.addFilter(SamplingFilter(sample_every, None if max_per_second is None else float(max_per_second)))
+    return item_logger
+
+
+def _stop_listener(name):
+    listener = _listeners.pop(name)
+    # Nothing reads the queue once the listener stopped: the records logged from now on go to the other handlers,
+    # or to logging.lastResort, instead of being lost in it
+    logger = logging.getLogger(name)
+    for handler in [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler)
+                    and h.queue is listener.queue]:
+        logger.removeHandler(handler)
+    # stop() puts a sentinel on the queue and waits for the thread, so every record before it gets written
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def shutdown_logging():
+    """
+    Flush and stop the background threads of all the loggers, then shut the logging down
+
+    Returns
+    -------
+    None
+    """
+    with _listeners_lock:
+        for name in list(_listeners):
+            _stop_listener(name)
+    logging.shutdown()
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,60 @@
+import unittest
+import io
+import os
+import logging
+from unittest import mock
+from common import logger
+
+
+class TestLogger(unittest.TestCase):
+
+    def test_sampling_filter(self):
+        sampling_filter = logger.SamplingFilter(sample_every=3)
+        record = logging.makeLogRecord({})
+        self.assertEqual([sampling_filter.filter(record) for _ in range(7)],
+                         [True, False, False, True, False, False, True])
+
+    def test_rate_limit(self):
+        sampling_filter = logger.SamplingFilter(max_per_second=2)
+        record = logging.makeLogRecord({})
+        with mock.patch.object(logger.time, 'monotonic', side_effect=[10.0, 10.1, 10.2, 11.5]):
+            self.assertEqual([sampling_filter.filter(record) for _ in range(4)], [True, True, False, True])
+
+    def test_records_written_by_listener(self):
+        test_logger = logger.init_logger('common_test_logger')
+        file_handler = logger._listeners['common_test_logger'].handlers[1]
+        with mock.patch.dict(os.environ, {'LOG_SAMPLE_COMMON_TEST_LOGGER_ITEMS': '2'}):
+            item_logger = logger.get_item_logger(test_logger)
+        for index in range(4):
+            item_logger.info('Item %d', index)
+        # Stopping the listener flushes the queue
+        logger._stop_listener('common_test_logger')
+        with open(file_handler.baseFilename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith('Item 0'))
+        self.assertTrue(lines[1].endswith('Item 2'))
+
+    def test_records_after_shutdown(self):
+        test_logger = logger.init_logger('common_test_logger_shutdown')
+        logger._stop_listener('common_test_logger_shutdown')
+        self.assertEqual(test_logger.handlers, [])
+        # As in a script, where the root logger has no handler either (the test runner adds one)
+        with mock.patch.object(test_logger, 'propagate', False), \
+                mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            test_logger.warning('After shutdown')
+        self.assertIn('After shutdown', stderr.getvalue())
+
+    def test_arguments_logged_as_they_were(self):
+        test_logger = logger.init_logger('common_test_logger_arguments')
+        file_handler = logger._listeners['common_test_logger_arguments'].handlers[1]
+        items = ['a']
+        test_logger.info('Items %s', items)
+        items.append('b')
+        logger._stop_listener('common_test_logger_arguments')
+        with open(file_handler.baseFilename) as f:
+            self.assertTrue(f.read().rstrip().endswith("Items ['a']"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import os
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import paramiko
+from common import transport
+
+SERVER_KEY = paramiko.ECDSAKey.generate()
+
+
+class FakeTransport:
+    """
+    Stand-in for a ``paramiko.Transport``, recording the connections made and how they were authenticated
+    """
+
+    connections = []
+    server_key = SERVER_KEY
+
+    def __init__(self, address):
+        self.address = address
+        self.auth = None
+        self.active = True
+        FakeTransport.connections.append(self)
+
+    def start_client(self):
+        pass
+
+    def get_remote_server_key(self):
+        return self.server_key
+
+    def auth_password(self, username, password):
+        self.auth = ('password', username, password)
+
+    def auth_publickey(self, username, key):
+        self.auth = ('publickey', username, key.get_base64())
+
+    def set_keepalive(self, interval):
+        pass
+
+    def is_active(self):
+        return self.active
+
+    def close(self):
+        self.active = False
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        FakeTransport.connections = []
+        for patcher in [mock.patch.object(transport, '_credentials', {}),
+                        mock.patch.object(transport, '_transports', {}),
+                        mock.patch.object(transport, '_connect_locks', {}),
+                        mock.patch.object(transport, '_host_keys', None),
+                        mock.patch.dict(transport._host_key_options, {'known_hosts': None}),
+                        mock.patch.object(paramiko, 'Transport', FakeTransport),
+                        mock.patch.object(paramiko.SFTPClient, 'from_transport',
+                                          side_effect=lambda t: mock.Mock(transport=t))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shared_transport(self):
+        transport.set_credentials('20.30.40.51', username='osama', password='secret')
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            sessions = list(executor.map(lambda _: transport.open_sftp('20.30.40.51'), range(8)))
+        # One connection and one authentication, every session is a channel on it
+        self.assertEqual(len(FakeTransport.connections), 1)
+        self.assertEqual(FakeTransport.connections[0].address, ('20.30.40.51', 22))
+        self.assertEqual(FakeTransport.connections[0].auth, ('password', 'osama', 'secret'))
+        self.assertEqual({session.sftp_client.transport for session in sessions}, {FakeTransport.connections[0]})
+
+        # Another user gets its own transport, and a dropped transport is replaced
+        transport.open_sftp('20.30.40.51', 'trader')
+        FakeTransport.connections[0].active = False
+        transport.open_sftp('20.30.40.51')
+        self.assertEqual(len(FakeTransport.connections), 3)
+        self.assertEqual(transport._transports[('20.30.40.51', 'osama')], FakeTransport.connections[2])
+
+        transport.close_all_transports()
+        self.assertFalse(any(connection.active for connection in FakeTransport.connections))
+        with self.assertRaises(ValueError):
+            transport.open_sftp('20.30.40.52')
+
+    def test_config_and_host_keys(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            known_hosts = os.path.join(tempdir, 'known_hosts')
+            with open(known_hosts, 'w') as f:
+                f.write(f'20.30.40.51 {SERVER_KEY.get_name()} {SERVER_KEY.get_base64()}\n')
+            private_key = os.path.join(tempdir, 'id_ecdsa')
+            client_key = paramiko.ECDSAKey.generate()
+            client_key.write_private_key_file(private_key)
+            config_file = os.path.join(tempdir, 'ssh_config.json')
+            with open(config_file, 'w') as f:
+                json.dump({'known_hosts': known_hosts, 'strict_host_keys': True,
+                           'default': {'username': 'osama', 'private_key': private_key},
+                           'hosts': {'20.30.40.52': {'username': 'trader', 'password': 'secret', 'port': 2222}}}, f)
+            transport.load_config(config_file)
+
+            transport.open_sftp('20.30.40.51')
+            self.assertEqual(FakeTransport.connections[0].auth, ('publickey', 'osama', client_key.get_base64()))
+            self.assertEqual(transport.get_credentials('20.30.40.52')['port'], 2222)
+
+            # Unknown hosts are refused when strict, and trusted for the process otherwise
+            with self.assertRaises(paramiko.SSHException):
+                transport.open_sftp('20.30.40.52')
+            transport._host_key_options['strict_host_keys'] = False
+            transport.open_sftp('20.30.40.52')
+            self.assertEqual(FakeTransport.connections[-1].auth, ('password', 'trader', 'secret'))
+            self.assertIsNotNone(transport.get_host_keys().lookup('[20.30.40.52]:2222'))
+
+            # A changed host key is always refused, and the failed transport closed
+            FakeTransport.connections[0].active = False
+            with mock.patch.object(FakeTransport, 'server_key', paramiko.ECDSAKey.generate()):
+                with self.assertRaises(paramiko.BadHostKeyException):
+                    transport.open_sftp('20.30.40.51')
+            self.assertIsNone(FakeTransport.connections[-1].auth)
+            self.assertFalse(FakeTransport.connections[-1].active)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,373 @@
+"""
+SSH connections shared by all the tools of this repository.
+
+Every tool used to open its own ```pysftp.Connection``` per session, each paying for a TCP connection, a key
+exchange and an authentication, with its own hard-coded credentials and host key policy. Here a process-wide
+registry keeps one authenticated ```paramiko.Transport``` per (host, username), and every SFTP session
+(```open_sftp```) is a new channel multiplexed on it. Only the first session to a server pays for the handshakes,
+the next ones (from any thread) only open a channel. A transport that dropped is replaced on its next use.
+
+The credentials of the servers and the known host keys are read once, from a JSON file given to ```load_config```:
+```
+{
+   "known_hosts": "~/.ssh/known_hosts",
+   "strict_host_keys": false,
+   "default": {"username": "osama", "private_key": "Problem3/id_rsa"},
+   "hosts": {"20.30.40.51": {"username": "trader", "password": "some_random_password", "port": 2222}}
+}
+```
+or set by the tools with ```set_credentials```. The key of a server is checked against the known hosts. A key that
+changed is always refused. An unknown key is refused with ```strict_host_keys```, or else trusted for the rest of
+the process.
+"""
+
+import os
+import json
+import atexit
+import logging
+import threading
+import time
+from common.lazy_import import lazy_import
+
+paramiko = lazy_import('paramiko')
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 22
+# Seconds between two keepalive messages on an idle transport, so that firewalls do not drop it
+KEEPALIVE_INTERVAL = 30
+
+# The credentials of every host, the ones under None are used for any host
+_credentials = {}
+_host_key_options = {'known_hosts': '~/.ssh/known_hosts', 'strict_host_keys': False}
+_host_keys = None
+_private_keys = {}
+# The authenticated transport of every (host, username), and the lock connecting it
+_transports = {}
+_connect_locks = {}
+_registry_lock = threading.Lock()
+
+
+class SFTPSession:
+    """
+    SFTP session on a channel of a shared transport, with the subset of the ``pysftp.Connection`` interface used by
+    the tools (``exists``, ``sftp_client``, and every method of ``paramiko.SFTPClient``). Closing the session only
+    closes its channel, the transport stays open for the next sessions.
+    """
+
+    sftp_client = None
+
+    def __init__(self, transport):
+        self.sftp_client = paramiko.SFTPClient.from_transport(transport)
+
+    def __getattr__(self, attribute):
+        return getattr(self.sftp_client, attribute)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def exists(self, remote_path):
+        try:
+            self.sftp_client.stat(remote_path)
+        except IOError:
+            return False
+        return True
+
+    def close(self):
+        self.sftp_client.close()
+
+
+def set_credentials(host=None, username=None, password=None, private_key=None, port=None):
+    """
+    Set the credentials of a host. The values not given are left as they were
+    Parameters
+    ----------
+    host: str
+        The host, or None for the credentials used for any host
+    username: str
+        The user to log in as
+    password: str
+        The password of the user
+    private_key: str
+        Path of the private key of the user, used instead of the password if both are given
+    port: int
+        The SSH port of the host
+
+    Returns
+    -------
+    None
+    """
+    values = {'username': username, 'password': password, 'private_key': private_key, 'port': port}
+    _credentials.setdefault(host, {}).update({key: value for key, value in values.items() if value is not None})
+
+
+def get_credentials(host):
+    """
+    Get the credentials of a host, the ones set for the host over the ones set for any host. A password or key set
+    for the host replaces both the password and the key set for any host
+    Parameters
+    ----------
+    host: str
+        The host
+
+    Returns
+    -------
+    dict
+        The ``username``, ``password``, ``private_key`` and ``port`` set, with a ``port`` of 22 by default
+    """
+    credentials = {'port': DEFAULT_PORT, **_credentials.get(None, {})}
+    host_credentials = _credentials.get(host, {})
+    if 'password' in host_credentials or 'private_key' in host_credentials:
+        credentials.pop('password', None)
+        credentials.pop('private_key', None)
+    credentials.update(host_credentials)
+    return credentials
+
+
+def set_host_key_options(known_hosts=None, strict_host_keys=None):
+    """
+    Set how the host keys are checked. The options not given are left as they were, and the known hosts are read
+    again on the next connection
+    Parameters
+    ----------
+    known_hosts: str
+        Path of the known hosts file
+    strict_host_keys: bool
+        Whether the hosts not in the known hosts are refused, instead of trusted for the rest of the process
+
+    Returns
+    -------
+    None
+    """
+    global _host_keys
+    values = {'known_hosts': known_hosts, 'strict_host_keys': strict_host_keys}
+    _host_key_options.update({key: value for key, value in values.items() if value is not None})
+    with _registry_lock:
+        _host_keys = None
+
+
+def load_config(config_file):
+    """
+    Load the credentials and the host key options from a JSON file (see the module documentation)
+    Parameters
+    ----------
+    config_file: str
+        Path of the JSON file
+
+    Returns
+    -------
+    None
+    """
+    with open(config_file) as f:
+        config = json.load(f)
+    set_host_key_options(config.get('known_hosts'), config.get('strict_host_keys'))
+    set_credentials(**config.get('default', {}))
+    for host, credentials in config.get('hosts', {}).items():
+        set_credentials(host, **credentials)
+
+
+def get_host_keys():
+    """
+    Get the known host keys, read from the known hosts file on the first call
+
+    Returns
+    -------
+    paramiko.HostKeys
+        The known host keys, with the keys trusted on first use since
+    """
+    global _host_keys
+    with _registry_lock:
+        if _host_keys is None:
+            _host_keys = paramiko.HostKeys()
+            known_hosts = _host_key_options['known_hosts']
+            if known_hosts is not None and os.path.isfile(os.path.expanduser(known_hosts)):
+                _host_keys.load(os.path.expanduser(known_hosts))
+        return _host_keys
+
+
+def check_host_key(host, port, key):
+    """
+    Check the key a server presented against the known host keys
+    Parameters
+    ----------
+    host: str
+        The host
+    port: int
+        The SSH port of the host
+    key: paramiko.PKey
+        The key presented by the server
+
+    Returns
+    -------
+    None
+        Raises ``paramiko.BadHostKeyException`` if the key changed, and ``paramiko.SSHException`` if it is unknown
+        and the host keys are strict
+    """
+    name = host if port == DEFAULT_PORT else f'[{host}]:{port}'
+    host_keys = get_host_keys()
+    with _registry_lock:
+        known_keys = host_keys.lookup(name) or {}
+        if key.get_name() in known_keys:
+            if known_keys[key.get_name()] != key:
+                raise paramiko.BadHostKeyException(name, key, known_keys[key.get_name()])
+            return
+        if _host_key_options['strict_host_keys']:
+            raise paramiko.SSHException(f'The host key of {name} is not in the known hosts')
+        log.warning(f'Trusting the unknown {key.get_name()} host key of {name} for this process')
+        host_keys.add(name, key.get_name(), key)
+
+
+def load_private_key(private_key):
+    """
+    Read a private key file, once per process
+    Parameters
+    ----------
+    private_key: str
+        Path of the private key
+
+    Returns
+    -------
+    paramiko.PKey
+        The private key
+    """
+    if private_key not in _private_keys:
+        errors = []
+        for key_class in [paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key]:
+            try:
+                _private_keys[private_key] = key_class.from_private_key_file(private_key)
+                break
+            except paramiko.SSHException as error:
+                errors.append(error)
+        else:
+            raise paramiko.SSHException(f'Could not read the private key {private_key}: {errors}')
+    return _private_keys[private_key]
+
+
+def connect(host, username):
+    """
+    Open a new transport to a host: connect, exchange the keys, check the host key and authenticate
+    Parameters
+    ----------
+    host: str
+        The host
+    username: str
+        The user to log in as
+
+    Returns
+    -------
+    paramiko.Transport
+        The authenticated transport
+    """
+    credentials = get_credentials(host)
+    if credentials.get('private_key') is None and credentials.get('password') is None:
+        raise ValueError(f'No password or private key to log in to {host} as {username}')
+    start = time.perf_counter()
+    transport = paramiko.Transport((host, credentials['port']))
+    try:
+        transport.start_client()
+        check_host_key(host, credentials['port'], transport.get_remote_server_key())
+        if credentials.get('private_key') is not None:
+            transport.auth_publickey(username, load_private_key(credentials['private_key']))
+        else:
+            transport.auth_password(username, credentials['password'])
+        transport.set_keepalive(KEEPALIVE_INTERVAL)
+    except Exception:
+        transport.close()
+        raise
+    log.info(f'Connected to {username}@{host} in {time.perf_counter() - start:.3f}s')
+    return transport
+
+
+def get_transport(host, username=None):
+    """
+    Get the authenticated transport of a host and user, connecting it only if there is none yet or if it dropped.
+    Two threads asking for the same host and user wait for a single connection
+    Parameters
+    ----------
+    host: str
+        The host
+    username: str
+        The user to log in as, the one of the credentials of the host if None
+
+    Returns
+    -------
+    paramiko.Transport
+        The authenticated transport
+    """
+    username = username or get_credentials(host).get('username')
+    if username is None:
+        raise ValueError(f'No username to log in to {host}')
+    key = (host, username)
+    with _registry_lock:
+        connect_lock = _connect_locks.setdefault(key, threading.Lock())
+    with connect_lock:
+        transport = _transports.get(key)
+        if transport is not None and transport.is_active():
+            return transport
+        if transport is not None:
+            log.info(f'The connection to {username}@{host} dropped, reconnecting')
+            transport.close()
+        transport = _transports[key] = connect(host, username)
+        return transport
+
+
+def open_sftp(host, username=None):
+    """
+    Open an SFTP session to a host, on a new channel of its shared transport. If the channel cannot be opened, the
+    transport is replaced once
+    Parameters
+    ----------
+    host: str
+        The host
+    username: str
+        The user to log in as, the one of the credentials of the host if None
+
+    Returns
+    -------
+    SFTPSession
+        The SFTP session, to be closed after use (it can be used as a context manager)
+    """
+    transport = get_transport(host, username)
+    try:
+        return SFTPSession(transport)
+    except (paramiko.SSHException, EOFError, OSError) as error:
+        log.info(f'Could not open a channel to {host} ({error}), reconnecting')
+        transport.close()
+        return SFTPSession(get_transport(host, username))
+
+
+def close_transport(host, username=None):
+    """
+    Close the transport of a host and user, and every channel on it, if any
+    Parameters
+    ----------
+    host: str
+        The host
+    username: str
+        The user, the one of the credentials of the host if None
+
+    Returns
+    -------
+    None
+    """
+    transport = _transports.pop((host, username or get_credentials(host).get('username')), None)
+    if transport is not None:
+        transport.close()
+
+
+def close_all_transports():
+    """
+    Close all the transports of the process
+
+    Returns
+    -------
+    None
+    """
+    for key in list(_transports):
+        close_transport(*key)
+
+
+atexit.register(close_all_transports)
@@ -32,46 +32,13 @@ is, whether to download sub-folders or not.
 """
 
 import sys
-import os
-import logging
-import tempfile
-import datetime
 import argparse
 import json
+from common.logger import init_logger, shutdown_logging
 
 log = None
 
 
-def init_logger():
-    """
-    Initializes the logger
-    Returns
-    -------
-    Logger object
-    """
-    tempdir = tempfile.mkdtemp(
-        prefix=f'downloader_framework_{os.getpid()}__{datetime.datetime.now().strftime("%H_%M_%S")}')
-
-    logger = logging.getLogger('downloader_framework')
-    logger.setLevel(logging.DEBUG)
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler(os.path.join(tempdir, 'logfile.log'))
-    fh.setLevel(logging.DEBUG)
-    # create console handler with a higher log level
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(filename)s:%(lineno)s - %(funcName)20s() - %(levelname)s - %(message)s')
-    ch.setFormatter(formatter)
-    fh.setFormatter(formatter)
-    # add the handlers to logger
-    logger.addHandler(ch)
-    logger.addHandler(fh)
-
-    return logger
-
-
 def parse_args():
     """
     Parses the arguments given to the script
@@ -121,11 +88,11 @@ def main():
         log.exception(error)
 
     finally:
-        logging.shutdown()
+        shutdown_logging()
 
 
 if __name__ == '__main__':
     # Initialize the logger
-    log = init_logger()
+    log = init_logger('downloader_framework')
     # Call the main function
     sys.exit(main())